@@ -0,0 +1,367 @@
+# benchmark.py
+# BENCHMARK SUITE
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Command line arguments parsing
+import argparse
+
+# Results and baseline files
+import json
+
+# Scripts run in their own process each
+import subprocess
+import sys
+
+# Hot paths timed in this process
+from simulation import run_qc, phase_circuit, sample_qc
+from canvas import tiles_to_array
+from experiment3 import qc_processing
+from generate_sample_img import sample_imgs
+from functools import partial
+
+# Handy math library
+import numpy as np
+
+# For working directory and per-process resource usage
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL CONSTANTS
+# -----------------------------------------------------------------------------------
+
+# Directory of the benchmarked scripts
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Sample image rendered by the experiment3 cases
+SAMPLE_IMG = 'sample_cont_interp_rad'
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# In-process cases of the hot paths: name, function and number of shots
+#
+# Single simulator calls, processing of the experiment3 sample image with every
+# method, tile assembly and the sample generator. The analytic engine ignores the
+# method, so it gets a single processing case.
+
+def bench_functions(sidelengths, resolutions, methods, engine, seed):
+    cases = []
+    methods = methods if engine == 'aer' else methods[:1]
+
+    for a in sidelengths:
+
+        # Sample generation (no shots)
+        cases.append((f"sample_imgs_{a}px", lambda a=a: list(sample_imgs(a)), 0))
+
+        # Single simulator call of a canvas
+        if engine == 'aer':
+            qc = phase_circuit(0.5)
+            cases.append((f"run_qc_aer_{a}px", partial(run_qc, qc, 'sim_noise', 'bits', a ** 2, seed), a ** 2))
+        else:
+            cases.append((f"sample_qc_analytic_{a}px", partial(sample_qc, [0.5], 'sim_noise', a ** 2, seed=seed), a ** 2))
+
+        # Processing and assembly of the sample image of the same side length
+        canvas = next(c for c, name in sample_imgs(a) if name == f"{SAMPLE_IMG}_{a}x{a}px.png")
+        data = np.reshape(canvas, (a * a, 1))
+        for r in resolutions:
+            for method in methods:
+                label = method if engine == 'aer' else engine
+                process = qc_processing(engine, method, 0)
+                cases.append((f"qc_processing_{label}_{a}px_x{r}", partial(process, data, r, 0, seed=seed, row=0, width=a), (a * r) ** 2))
+
+            tiles = np.random.default_rng(seed).integers(0, 2, (a * a, r, r), dtype=np.uint8)
+            cases.append((f"tiles_to_array_{a}px_x{r}", partial(tiles_to_array, tiles, a), (a * r) ** 2))
+
+    return cases
+
+# -----------------------------------------------------------------------------------
+
+# End-to-end cases, every script in a fresh process: name, script arguments and
+# number of shots
+
+def bench_scripts(sidelengths, resolutions, samples, methods, engine, seed):
+    cases = []
+    common = ['--engine', engine, '--seed', str(seed)]
+    methods = methods if engine == 'aer' else methods[:1]
+
+    for a in sidelengths:
+
+        # Sample generation (no shots)
+        cases.append((f"generate_sample_img_{a}px", ['generate_sample_img.py', '--sidelength', str(a)], 0))
+
+        # Experiment 1
+        cases.append((f"experiment1_{engine}_{a}px", ['experiment1.py', '--method', 'episodic', '--sidelength', str(a)] + common, a ** 2))
+
+        # Experiment 2
+        for n in samples:
+            cases.append((f"experiment2_{engine}_{n}_samples_{a}px", ['experiment2.py', '--method', 'range', '--samples', str(n), '--sidelength', str(a)] + common, n * a ** 2))
+
+        # Experiment 3 on a sample image of the same side length
+        img = os.path.join('sample_img', f"{a}x{a}", f"{SAMPLE_IMG}_{a}x{a}px.png")
+        for r in resolutions:
+            for method in methods:
+                label = method if engine == 'aer' else engine
+                cases.append((f"experiment3_{label}_{a}px_x{r}", ['experiment3.py', '--input', img, '--resolution', str(r), '--method', method] + common, (a * r) ** 2))
+
+    return cases
+
+# -----------------------------------------------------------------------------------
+
+# Run one script in a fresh process: wall time (s) and peak RSS (MB, None if unknown)
+#
+# stderr goes to a temporary file, so a chatty child never blocks on a full pipe
+# and the message of a failed one can still be shown.
+
+def bench_run(argv, cwd):
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-W', 'ignore', os.path.join(ROOT, argv[0])] + argv[1:],
+                                cwd=cwd, stdout=subprocess.DEVNULL, stderr=err)
+
+        # Resource usage of exactly this child (Unix only)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - start
+            returncode = os.waitstatus_to_exitcode(status)
+            rss = usage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+        else:
+            returncode = proc.wait()
+            wall = time.perf_counter() - start
+            rss = None
+
+        if returncode != 0:
+            err.seek(0)
+            raise RuntimeError(f"{' '.join(argv)} failed:\n{err.read().decode(errors='replace')}")
+
+    return wall, rss
+
+# -----------------------------------------------------------------------------------
+
+# Call one function in this process: wall time (s), no peak RSS of its own
+
+def bench_call(function):
+    start = time.perf_counter()
+    function()
+
+    return time.perf_counter() - start, None
+
+# -----------------------------------------------------------------------------------
+
+# Run all cases of a group, best wall time (and its peak RSS) of repeat runs each.
+# A case is a function, called once untimed first to warm up imports, simulator and
+# caches, or the arguments of a script.
+
+def bench_suite(cases, repeat, cwd, group):
+    results = {}
+    for name, case, shots in cases:
+        if callable(case):
+            case()
+            runs = [bench_call(case) for _ in range(repeat)]
+        else:
+            runs = [bench_run(case, cwd) for _ in range(repeat)]
+        wall, rss = min(runs)
+
+        results[name] = {
+            'group': group,
+            'wall_s': round(wall, 6),
+            'peak_rss_mb': round(rss, 1) if rss is not None else None,
+            'shots': shots,
+            'shots_per_s': round(shots / wall, 1) if shots else None,
+        }
+        print(f"{name:<48} {wall:9.4f} s {results[name]['peak_rss_mb'] or '-':>9} MB", file=sys.stderr)
+
+    return results
+
+# -----------------------------------------------------------------------------------
+
+# Compare wall times with a baseline; names of cases slower than the tolerance
+
+def bench_compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result['wall_s'] / max(baseline[name]['wall_s'], 1e-9)
+        result['baseline_ratio'] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+
+        print(f"{name:<48} {ratio:9.2f} x baseline", 'SLOWER' if name in regressions else '', file=sys.stderr)
+
+    return regressions
+
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
+
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to time the hot
+                        paths (simulator calls, processing methods,
+                        assembly, sample generator) in this process
+                        and the experiments end to end over a sweep
+                        of side lengths, resolutions, sample counts
+                        and methods.
+                        ''',
+        epilog      =   '''
+                        Wall time, peak memory and shots per
+                        second of every case are written to a
+                        JSON results file.
+                        ''')
+
+    parser.add_argument('--sidelength',
+        type        =   int,
+        nargs       =   '+',
+        default     =   [8, 16],
+        help        =   '''
+                        Side lengths of the canvases and sample
+                        images, e.g. 8 16 32.
+                        ''')
+
+    parser.add_argument('--resolution',
+        type        =   int,
+        nargs       =   '+',
+        default     =   [2, 4],
+        help        =   '''
+                        Resolutions of the experiment3 cases,
+                        e.g. 2 4.
+                        ''')
+
+    parser.add_argument('--samples',
+        type        =   int,
+        nargs       =   '+',
+        default     =   [15],
+        help        =   '''
+                        Number of images of the experiment2 range
+                        cases, e.g. 15 100.
+                        ''')
+
+    parser.add_argument('--method',
+        type        =   str,
+        nargs       =   '+',
+        default     =   ['serial', 'parallel'],
+        choices     =   ['serial', 'parallel'],
+        help        =   '''
+                        Methods of the experiment3 cases.
+                        ''')
+
+    parser.add_argument('--engine',
+        type        =   str,
+        required    =   False,
+        default     =   'aer',
+        choices     =   ['aer', 'analytic'],
+        help        =   '''
+                        Engine of all experiment cases.
+                        ''')
+
+    parser.add_argument('--group',
+        type        =   str,
+        nargs       =   '+',
+        default     =   ['functions', 'scripts'],
+        choices     =   ['functions', 'scripts'],
+        help        =   '''
+                        Groups of cases: hot paths timed in this
+                        process after a warm-up run ('functions')
+                        and scripts run end to end in a fresh
+                        process each ('scripts').
+                        ''')
+
+    parser.add_argument('--repeat',
+        type        =   int,
+        required    =   False,
+        default     =   3,
+        help        =   '''
+                        Runs per case, the fastest one counts.
+                        ''')
+
+    parser.add_argument('--output',
+        type        =   str,
+        required    =   False,
+        default     =   'benchmark_results.json',
+        help        =   '''
+                        JSON file for the results.
+                        ''')
+
+    parser.add_argument('--baseline',
+        type        =   str,
+        required    =   False,
+        help        =   '''
+                        JSON results file of an earlier run to
+                        compare against. Exits with status 1 if
+                        a case got slower than the tolerance.
+                        ''')
+
+    parser.add_argument('--tolerance',
+        type        =   float,
+        required    =   False,
+        default     =   0.2,
+        help        =   '''
+                        Allowed slowdown against the baseline,
+                        e.g. 0.2 for 20 percent.
+                        ''')
+
+    args = parser.parse_args()
+
+    # -----------------------------------------------------------------------------------
+
+    # Scratch directory for all outputs and working directory of all cases (the
+    # sample generator reads its font from there)
+    home = os.getcwd()
+    cwd = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        shutil.copy(os.path.join(ROOT, 'Inter-Regular.ttf'), cwd)
+        os.chdir(cwd)
+
+        # Argument 'group' (scripts first: children start with the peak RSS of this
+        # process, which grows once the functions have loaded the simulator)
+        results = {}
+        if 'scripts' in args.group:
+            cases = bench_scripts(args.sidelength, args.resolution, args.samples, args.method, args.engine, 0)
+            results.update(bench_suite(cases, args.repeat, cwd, 'scripts'))
+        if 'functions' in args.group:
+            cases = bench_functions(args.sidelength, args.resolution, args.method, args.engine, 0)
+            results.update(bench_suite(cases, args.repeat, cwd, 'functions'))
+
+    finally:
+        os.chdir(home)
+        shutil.rmtree(cwd, ignore_errors=True)
+
+    # Argument 'baseline'
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = bench_compare(results, json.load(f)['results'], args.tolerance)
+
+    # Write results
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+        }, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# cache.py
+# SHARED RESULT CACHE
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Handy math libraries
+import numpy as np
+
+# Hashing of cache keys
+import hashlib
+
+# For saving files in cache directory
+import os
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# Content address of everything a result depends on (arrays by their bytes)
+
+def cache_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(repr((part.dtype.str, part.shape)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+# -----------------------------------------------------------------------------------
+
+# Load cached array, None if missing
+
+def cache_load(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.npy")
+    try:
+        out = np.load(path)
+
+        # Mark as recently used for eviction
+        os.utime(path)
+
+    # Missing or evicted meanwhile by another process
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+    return out
+
+# -----------------------------------------------------------------------------------
+
+# Store array and evict least recently used entries beyond max_mb
+
+def cache_store(cache_dir, key, array, max_mb=1024):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary file first so readers never see half an entry
+    path = os.path.join(cache_dir, f"{key}.npy")
+    tmp = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+    cache_evict(cache_dir, max_mb)
+
+# -----------------------------------------------------------------------------------
+
+# Delete least recently used entries until the cache fits into max_mb
+
+def cache_evict(cache_dir, max_mb):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npy'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 2 ** 20:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,335 @@
+# canvas.py
+# SHARED IMAGE ASSEMBLING
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# PILlow for image generation
+from PIL import Image
+
+# Handy math libraries
+import numpy as np
+
+# Streaming PNG and TIFF encoding
+import struct
+import zlib
+
+# Progress files of memory-mapped canvases
+import json
+import os
+
+# Stage timers for --profile
+from profiling import stage
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL CONSTANTS
+# -----------------------------------------------------------------------------------
+
+# Size of the IDAT chunks of a streamed PNG
+IDAT_SIZE = 2 ** 16
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# Arrange grid of patches (square unless n_cols is given) into one canvas
+#
+# Patch j + (a * i) lands in grid row i and column j; inside a patch, index [k][l]
+# is column k and row l. All done by one reshape/transpose instead of putpixel.
+# Patches shaped [color][k][l] give a color canvas (rows, columns, colors).
+
+def tiles_to_array(data_vals, n_cols=None):
+    data = np.asarray(data_vals)
+    a = n_cols if n_cols else int(len(data) ** (1/2))
+    b = len(data) // a if n_cols else a
+    c = data.shape[-2]
+    d = data.shape[-1]
+
+    with stage('assembly'):
+        if data.ndim == 4:
+            e = data.shape[1]
+            canvas = data[:a * b].reshape(b, a, e, c, d).transpose(0, 4, 1, 3, 2).reshape(b * d, a * c, e)
+        else:
+            canvas = data[:a * b].reshape(b, a, c, d).transpose(0, 3, 1, 2).reshape(b * d, a * c)
+
+        canvas = (canvas * 255).astype(np.uint8)
+
+    return canvas
+
+# -----------------------------------------------------------------------------------
+
+# Output image generating
+
+def img_generating(data_vals, path):
+    img = Image.fromarray(tiles_to_array(data_vals))
+
+    #img.show()
+    with stage('encoding'):
+        img.save(path)
+
+# -----------------------------------------------------------------------------------
+
+# Write one PNG chunk (length, tag, data, checksum)
+
+def png_chunk(file, tag, data):
+    file.write(struct.pack('>I', len(data)))
+    file.write(tag + data)
+    file.write(struct.pack('>I', zlib.crc32(tag + data)))
+
+# -----------------------------------------------------------------------------------
+
+# Raw PNG scanlines of rows: filter type 0 (none) in front of every row
+
+def png_rows(rows, width):
+    rows = np.asarray(rows, dtype=np.uint8).reshape(-1, width)
+    raw = np.zeros((len(rows), width + 1), dtype=np.uint8)
+    raw[:, 1:] = rows
+
+    return raw.tobytes()
+
+# -----------------------------------------------------------------------------------
+
+# PNG header: signature and IHDR, color type 0 (greyscale) or 2 (RGB), 8 bit
+
+def png_header(file, width, height, colors):
+    file.write(b'\x89PNG\r\n\x1a\n')
+    png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0 if colors == 1 else 2, 0, 0, 0))
+
+# -----------------------------------------------------------------------------------
+
+# Greyscale (or RGB) PNG written band by band, never holding the whole image
+#
+# Rows go through one zlib stream, cut into IDAT chunks of IDAT_SIZE bytes, which
+# decoders read as one continuous stream. The file is the same however the rows
+# are split into bands.
+
+class PngStream:
+
+    def __init__(self, path, width, height, colors=1):
+        self.width = width * colors
+        self.file = open(path, 'wb')
+        self.zip = zlib.compressobj()
+        self.data = bytearray()
+
+        png_header(self.file, width, height, colors)
+
+    def write(self, rows):
+        with stage('encoding'):
+            self.data += self.zip.compress(png_rows(rows, self.width))
+            self.write_chunks(IDAT_SIZE)
+
+    def write_chunks(self, size):
+        while len(self.data) >= size:
+            png_chunk(self.file, b'IDAT', bytes(self.data[:IDAT_SIZE]))
+            del self.data[:IDAT_SIZE]
+
+    def close(self):
+        with stage('encoding'):
+            self.data += self.zip.flush()
+            self.write_chunks(1)
+            png_chunk(self.file, b'IEND', b'')
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+
+# Animated PNG written frame by frame, holding only the current frame
+#
+# The first frame is the default image (IDAT), all others follow as fdAT chunks.
+# Every fcTL/fdAT chunk carries the next sequence number.
+
+class ApngStream:
+
+    def __init__(self, path, width, height, n_frames, fps=10):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.seq = 0
+        self.file = open(path, 'wb')
+
+        # Frame count and endless looping
+        png_header(self.file, width, height, 1)
+        png_chunk(self.file, b'acTL', struct.pack('>II', n_frames, 0))
+
+    def write_frame(self, frame):
+
+        # Full canvas frame shown for 1/fps seconds
+        with stage('encoding'):
+            png_chunk(self.file, b'fcTL', struct.pack('>IIIIIHHBB', self.seq, self.width, self.height, 0, 0, 1, self.fps, 0, 0))
+            data = zlib.compress(png_rows(frame, self.width))
+
+            if self.seq == 0:
+                png_chunk(self.file, b'IDAT', data)
+                self.seq += 1
+            else:
+                png_chunk(self.file, b'fdAT', struct.pack('>I', self.seq + 1) + data)
+                self.seq += 2
+
+    def close(self):
+        png_chunk(self.file, b'IEND', b'')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+
+# Raw 8 bit greyscale frames, one after another, to a binary file (e.g. stdout)
+
+class RawStream:
+
+    def __init__(self, file):
+        self.file = file
+
+    def write_frame(self, frame):
+        with stage('encoding'):
+            self.file.write(np.asarray(frame, dtype=np.uint8).tobytes())
+
+    def close(self):
+        self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+
+# Canvas of height x width (x colors) in a memory-mapped .npy file on disk, written
+# band by band like PngStream
+#
+# Every written band is flushed to disk right away and the number of finished rows
+# is kept in a progress file next to it, along with a key of the render (e.g. a
+# hash of input and settings), so an interrupted render keeps everything already
+# done: opening the same path with the same shape and key continues after the last
+# finished row (rows), anything else starts over. The progress file is deleted once
+# the canvas is complete.
+
+class MemmapCanvas:
+
+    def __init__(self, path, width, height, colors=1, key=None):
+        self.path = path
+        self.progress = path + '.progress'
+        self.key = key
+        shape = (height, width, colors) if colors > 1 else (height, width)
+
+        self.rows = 0
+        if os.path.exists(path) and os.path.exists(self.progress):
+            with open(self.progress) as f:
+                progress = json.load(f)
+            self.data = np.lib.format.open_memmap(path, mode='r+')
+            if self.data.shape == shape and self.data.dtype == np.uint8 and progress.get('key') == key:
+                self.rows = progress['rows']
+                return
+            del self.data
+
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        self.save_progress()
+
+    # Continue with row (e.g. the first row of a band that was not finished)
+    def seek(self, row):
+        self.rows = row
+
+    def write(self, rows):
+        with stage('encoding'):
+            rows = np.asarray(rows, dtype=np.uint8)
+            self.data[self.rows:self.rows + len(rows)] = rows
+            self.data.flush()
+            self.rows += len(rows)
+            self.save_progress()
+
+    # Written to a temporary file first, so it is never left half written
+    def save_progress(self):
+        with open(self.progress + '.tmp', 'w') as f:
+            json.dump({'rows': self.rows, 'key': self.key}, f)
+        os.replace(self.progress + '.tmp', self.progress)
+
+    def close(self):
+        self.data.flush()
+        if self.rows >= len(self.data):
+            os.remove(self.progress)
+        del self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+
+# Tiled TIFF of an 8 bit greyscale or RGB canvas (e.g. a MemmapCanvas on disk)
+#
+# Tiles of tile x tile pixels are deflate compressed one band of tiles at a time,
+# so only tile rows of the canvas are read into memory. The directory (IFD) goes
+# after the tiles. BigTIFF (64 bit offsets) is used once the file may exceed 4 GB,
+# or always with big=True.
+
+def tiff_export(canvas, path, tile=256, big=None):
+    h, w = canvas.shape[:2]
+    colors = canvas.shape[2] if canvas.ndim == 3 else 1
+    big = canvas.nbytes * 1.01 + 2 ** 20 > 2 ** 32 if big is None else big
+
+    # Offsets (LONG or LONG8), inline values of a directory entry (4 or 8 bytes)
+    offset, slot = ('Q', 8) if big else ('I', 4)
+    types = {'H': 3, 'I': 4, 'Q': 16}
+
+    offsets = []
+    counts = []
+    with stage('encoding'), open(path, 'wb') as f:
+
+        # Header, the directory offset is filled in at the end
+        f.write(b'II' + (struct.pack('<HHHQ', 43, 8, 0, 0) if big else struct.pack('<HI', 42, 0)))
+
+        for y in range(0, h, tile):
+            band = np.asarray(canvas[y:y + tile])
+            for x in range(0, w, tile):
+                block = np.zeros((tile, tile) + band.shape[2:], dtype=np.uint8)
+                block[:len(band), :band.shape[1] - x] = band[:, x:x + tile]
+                data = zlib.compress(block.tobytes(), 6)
+                offsets.append(f.tell())
+                counts.append(len(data))
+                f.write(data)
+
+        entries = [
+            (256, 'I', [w]),                            # ImageWidth
+            (257, 'I', [h]),                            # ImageLength
+            (258, 'H', [8] * colors),                   # BitsPerSample
+            (259, 'H', [8]),                            # Compression (deflate)
+            (262, 'H', [1 if colors == 1 else 2]),      # Photometric (grey or RGB)
+            (277, 'H', [colors]),                       # SamplesPerPixel
+            (284, 'H', [1]),                            # PlanarConfiguration
+            (322, 'I', [tile]),                         # TileWidth
+            (323, 'I', [tile]),                         # TileLength
+            (324, offset, offsets),                     # TileOffsets
+            (325, offset, counts),                      # TileByteCounts
+        ]
+
+        # Values that do not fit into their entry go before the directory
+        fields = []
+        for tag, fmt, values in entries:
+            data = struct.pack(f"<{len(values)}{fmt}", *values)
+            if len(data) > slot:
+                f.write(b'\0' * (f.tell() % 2))
+                value = struct.pack(f"<{offset}", f.tell())
+                f.write(data)
+            else:
+                value = data.ljust(slot, b'\0')
+            fields.append(struct.pack('<HHQ' if big else '<HHI', tag, types[fmt], len(values)) + value)
+
+        # Directory (word aligned) and its offset in the header
+        f.write(b'\0' * (f.tell() % 2))
+        ifd = f.tell()
+        f.write(struct.pack(f"<{'Q' if big else 'H'}", len(fields)) + b''.join(fields) + struct.pack(f"<{offset}", 0))
+        f.seek(8 if big else 4)
+        f.write(struct.pack(f"<{offset}", ifd))
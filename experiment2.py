@@ -5,13 +5,21 @@
 # INCLUDE ALL MODULES
 # -----------------------------------------------------------------------------------
 
-# Qiskit for Quantum computation
-from qiskit import QuantumCircuit, Aer, transpile, execute
-from qiskit.providers.aer.noise import NoiseModel, QuantumError, ReadoutError, pauli_error
+# Shared simulation core (cached noise model and backend)
+from simulation import load_qiskit, run_qc_sweep, phase_circuit, sample_qc, stream_qc, stream_sample, derive_seed, seed_block, SHOT_CHUNK
 
 # PILlow for image generation
 from PIL import Image, ImageColor
 
+# Shared image assembling
+from canvas import img_generating, tiles_to_array, PngStream, ApngStream, RawStream
+
+# Shared result cache
+from cache import cache_key, cache_load, cache_store
+
+# Stage timers for --profile
+from profiling import stage, profile_enable, profile_report
+
 # Handy math libraries
 import numpy as np
 import math
@@ -22,70 +30,13 @@ import argparse
 # For saving files in current directory
 import os
 
+# Raw frame output to stdout
+import sys
+
 # -----------------------------------------------------------------------------------
 # DEFINE ALL FUNCTIONS
 # -----------------------------------------------------------------------------------
 
-# Simulate Quantum computation
-
-def run_qc(circuit, backend, output, n_shots):
-
-    # -------------------------------------------------------------------------------
-    
-    # Build basic bit-flip error noise model
-
-    # Example error probabilities
-    p_reset = 0.03
-    p_meas = 0.1
-    p_gate1 = 0.05
-
-    # QuantumError objects
-    error_reset = pauli_error([('X', p_reset), ('I', 1 - p_reset)])
-    error_meas = pauli_error([('X',p_meas), ('I', 1 - p_meas)])
-    error_gate1 = pauli_error([('X',p_gate1), ('I', 1 - p_gate1)])
-    error_gate2 = error_gate1.tensor(error_gate1)
-
-    # Add errors to noise model
-    noise_bit_flip = NoiseModel()
-    noise_bit_flip.add_all_qubit_quantum_error(error_reset, "reset")
-    noise_bit_flip.add_all_qubit_quantum_error(error_meas, "measure")
-    noise_bit_flip.add_all_qubit_quantum_error(error_gate1, ["u1", "u2", "u3"])
-    noise_bit_flip.add_all_qubit_quantum_error(error_gate2, ["cx"])
-    
-    # -------------------------------------------------------------------------------
-    
-    # Execution and options
-    
-    # Load simulator (Aer)
-    backend_simulate = Aer.get_backend('aer_simulator')
-    
-    # Execute on Aer
-    if (backend == 'sim'):
-        run = execute(circuit,
-                      backend_simulate,
-                      shots = n_shots,
-                      memory = True).result()
-        if (output == 'count'):
-            out = run.get_counts()
-        if (output == 'memory'):
-            out = run.get_memory()
-    
-    # Execute on Aer + noise model
-    if (backend == 'sim_noise'):
-        run = execute(circuit,
-                      backend_simulate,
-                      noise_model=noise_bit_flip,
-                      shots = n_shots,
-                      memory = True).result()
-        if (output == 'count'):
-            out = run.get_counts()
-        if (output == 'memory'):
-            out = run.get_memory()
-
-    return out
-
-# -----------------------------------------------------------------------------------
-
 # Map output values linear accoring to input values of x
 
 def lin_map(x, in_min, in_max, out_min, out_max):
@@ -96,133 +47,290 @@ def lin_map(x, in_min, in_max, out_min, out_max):
 
 # -----------------------------------------------------------------------------------
 
-# Generate output image
-
-def img_generating(data_vals, path):
-    a = int(len(data_vals) ** (1/2))
-    b = int(len(data_vals) ** (1/2))
-    c = int(len(data_vals[0]))
-    d = int(len(data_vals[0][0]))
-    img = Image.new('RGB', (a * c, b * d))
-
-    for i in range(a):
-        for j in range(b):
-            for k in range(c):
-                for l in range(d):
-                    color = int(data_vals[j + (a * i)][k][l] * 255) # [npatch index][npatch col][npatch row]
-                    img.putpixel(((k + (j * c)), l + (i * d)), (color, color, color)) # (x, y, rgb color)
+# Generate episodic images of radiant-regulated noise patterns for many phases
+#
+# All frames of batch_size phases go to the simulator as one job of a single
+# parameterized circuit; the images are assembled and written afterwards, either
+# to their own files or as frames into one stream (animation or raw). Streamed
+# batches are capped at one chunk of shots, a single frame for large canvases.
+# Seeded runs go in units of seed_block frames, each with the sub-seed of the index
+# of its first frame. Only seeded sweeps are cached, unseeded ones are simulated anew
+# every time.
+
+def sample_noise_range(phases, size, n_frames, paths, engine='aer', batch_size=0, stream=None, cache_dir=None, max_mb=1024, seed=None):
+
+    # Canvases larger than a chunk of shots are written image by image instead
+    if stream is None and size ** 2 > SHOT_CHUNK:
+        for i in range(len(phases)):
+            sample_noise(phases[i], size, n_frames, paths[i], engine, derive_seed(seed, i))
+        return
+
+    # Quantum circuit (Aer only)
+    if engine != 'analytic':
+        load_qiskit()
+        with stage('circuit'):
+            from qiskit.circuit import Parameter
+
+            phase = Parameter('phase')
+            qc = phase_circuit(phase, reset=False)
+
+    # One simulated frame per phase and frame number
+    frame_phases = np.repeat(phases, n_frames)
+    if batch_size <= 0:
+        batch_size = max(len(frame_phases), 1)
+
+    # Streamed frames: no more than one chunk of shots (at least one frame) at once
+    if stream:
+        batch_size = min(batch_size, max(SHOT_CHUNK // size ** 2, 1))
+
+    # Seeded frames go in units of a fixed size, so the output does not depend on the batch
+    if seed is not None:
+        batch_size = seed_block(size ** 2)
+
+    # Without a seed every sweep gets fresh noise, nothing is cached
+    if seed is None:
+        cache_dir = None
+
+    for i in range(0, len(frame_phases), batch_size):
+        batch = frame_phases[i:i + batch_size]
+
+        # Cached measurements of this batch
+        key = cache_key('sweep', engine, 'sim', batch, i, n_frames, size, seed)
+        results = None
+        if cache_dir:
+            with stage('cache'):
+                results = cache_load(cache_dir, key)
 
-    #img.show()
-    img.save(path)
+        # Measurements
+        if results is None:
+            if engine == 'analytic':
+                results = sample_qc(batch, 'sim', size ** 2, reset=False, seed=derive_seed(seed, i))
+            else:
+                results = run_qc_sweep(qc, phase, batch, 'sim', 'bits', size ** 2, derive_seed(seed, i))
+            results = np.reshape(results, (len(batch), size ** 2))
+
+            if cache_dir:
+                with stage('cache'):
+                    cache_store(cache_dir, key, results, max_mb)
+
+        # Image assembling (distinct files for more than one frame per phase)
+        for k in range(len(batch)):
+            if stream:
+                stream.write_frame(tiles_to_array([np.reshape(results[k], (size, size))]))
+                continue
+
+            path = frame_path(paths[(i + k) // n_frames], (i + k) % n_frames, n_frames)
+            img_generating([np.reshape(results[k], (size, size))], path)
 
 # -----------------------------------------------------------------------------------
 
 # Generate episodic image of radiant-regulated noise pattern
+#
+# Shots are streamed in chunks of whole canvas rows and written to disk as they
+# arrive, so the canvas size is limited by disk rather than by memory.
 
-def sample_noise(phase, size, n_frames, path):
+def sample_noise(phase, size, n_frames, path, engine='aer', seed=None):
     for m in range(n_frames):
-        data_out = []
-        
-        # Quantum circuit
-        qc = QuantumCircuit(1)
-        qc.h(0)
-        qc.ry(math.pi * phase, 0)
-        qc.measure_all()
 
         # Measurements
-        result = run_qc(qc, 'sim', 'memory', size ** 2)
-        result = np.reshape(result, (size, size)).astype(float)
-        data_out.append(result)
-        
-        # Image assembling
-        img_generating(data_out, path)
+        if engine == 'analytic':
+            results = stream_sample(phase, 'sim', size ** 2, size, reset=False, seed=derive_seed(seed, m))
+        else:
 
-# -----------------------------------------------------------------------------------
-# CALL FUNCTIONS ACCORDING TO ARGUMENTS
-# -----------------------------------------------------------------------------------
+            # Quantum circuit
+            load_qiskit()
+            with stage('circuit'):
+                qc = phase_circuit(phase, reset=False)
+
+            results = stream_qc(qc, 'sim', size ** 2, size, derive_seed(seed, m))
 
-# Argument parsing from command line
-parser = argparse.ArgumentParser(
-    description =   '''
-                    Use this piece of software to simulate,
-                    visulize, and *shift* superposition of
-                    a single qubit as noise patterns on a
-                    square canvas.
-                    ''',
-    epilog      =   '''
-                    Your created pattern image(s) will
-                    be filed in a directory that sits
-                    in the same place as this program.
-                    ''')
-
-parser.add_argument('--method',
-    type        =   str,
-    required    =   True,
-    choices     =   ['episodic', 'range'],
-    help        =   '''
-                    Choosing 'episodic' will give you a
-                    single image, while 'range' renders
-                    a whole array.
-                    ''')
-
-parser.add_argument('--phase',
-    type        =   float,
-    required    =   False,
-    help        =   '''
-                    Specify the phase that determines
-                    the ratio of black and white in the
-                    noise pattern.
-                    ''')
-
-parser.add_argument('--samples',
-    type        =   int,
-    required    =   False,
-    help        =   '''
-                    Choosing the 'range' method will give
-                    you a whole array of images with
-                    *shifting* ratios visible in the
-                    noise patterns. You need to specify
-                    the steps that determine the
-                    subdivisions inside the range as
-                    an integer such as 25 (giving you
-                    25 images).
-                    ''')
-
-parser.add_argument('--sidelength',
-    type        =   int,
-    required    =   True,
-    help        =   '''
-                    Specify the side length of your
-                    canvas as an integer such as 4.
-                    ''')
-
-args = parser.parse_args()
-
-# Create directory for output images
-out_dir = 'experiment2_output'
-path = os.path.join(os.getcwd(), out_dir)
-try:
-    os.mkdir(path)
-
-# Make sure directory does not get overwritten
-except FileExistsError:
-    pass
+        # Image assembling
+        with PngStream(frame_path(path, m, n_frames), size, size) as out:
+            for result in results:
+                out.write(np.reshape(result, (-1, size)) * 255)
 
 # -----------------------------------------------------------------------------------
 
-# Number of frames
-n_frames = 1
+# File path of frame m (distinct files for more than one frame per phase)
+
+def frame_path(path, m, n_frames):
+    if n_frames > 1:
+        return f"{path[:-4]}_frame{m}.png"
 
-# Argument 'episodic'
-if args.method == 'episodic':
-    phase_as_str = str(args.phase).replace('.', 'pt')
-    sample_noise(args.phase, args.sidelength, n_frames, f"{path}/{args.method}_{phase_as_str}_{args.sidelength}x{args.sidelength}px.png")
+    return path
 
-# Argument 'range'
-if args.method == 'range':
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
 
-    # Create directory for range
-    path = os.path.join(f"{os.getcwd()}/{out_dir}", f"{args.method}_{args.samples}_samples_{args.sidelength}x{args.sidelength}px")
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to simulate,
+                        visulize, and *shift* superposition of
+                        a single qubit as noise patterns on a
+                        square canvas.
+                        ''',
+        epilog      =   '''
+                        Your created pattern image(s) will
+                        be filed in a directory that sits
+                        in the same place as this program.
+                        ''')
+
+    parser.add_argument('--method',
+        type        =   str,
+        required    =   True,
+        choices     =   ['episodic', 'range'],
+        help        =   '''
+                        Choosing 'episodic' will give you a
+                        single image, while 'range' renders
+                        a whole array.
+                        ''')
+
+    parser.add_argument('--phase',
+        type        =   float,
+        required    =   False,
+        help        =   '''
+                        Specify the phase that determines
+                        the ratio of black and white in the
+                        noise pattern.
+                        ''')
+
+    parser.add_argument('--samples',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Choosing the 'range' method will give
+                        you a whole array of images with
+                        *shifting* ratios visible in the
+                        noise patterns. You need to specify
+                        the steps that determine the
+                        subdivisions inside the range as
+                        an integer such as 25 (giving you
+                        25 images).
+                        ''')
+
+    parser.add_argument('--sidelength',
+        type        =   int,
+        required    =   True,
+        help        =   '''
+                        Specify the side length of your
+                        canvas as an integer such as 4.
+                        ''')
+
+    parser.add_argument('--engine',
+        type        =   str,
+        required    =   False,
+        default     =   'aer',
+        choices     =   ['aer', 'analytic'],
+        help        =   '''
+                        Simulate circuits with 'aer' (default) or
+                        draw the shots from their exact outcome
+                        probabilities with 'analytic', which is
+                        much faster for large canvases.
+                        ''')
+
+    parser.add_argument('--frames',
+        type        =   int,
+        required    =   False,
+        default     =   1,
+        help        =   '''
+                        Number of images per phase, each written
+                        to its own file.
+                        ''')
+
+    parser.add_argument('--batch',
+        type        =   int,
+        required    =   False,
+        default     =   1024,
+        help        =   '''
+                        Number of images that are sent to the
+                        simulator at once using 'range' method.
+                        Use 0 to send all of them in a single call.
+                        Smaller batches keep memory usage low.
+                        ''')
+
+    parser.add_argument('--output',
+        type        =   str,
+        required    =   False,
+        default     =   'png',
+        choices     =   ['png', 'apng', 'raw'],
+        help        =   '''
+                        Using 'range' method, write one 'png' per
+                        image (default), stream all images into one
+                        animated PNG ('apng') or stream them as raw
+                        8 bit greyscale frames to stdout ('raw').
+                        ''')
+
+    parser.add_argument('--fps',
+        type        =   int,
+        required    =   False,
+        default     =   10,
+        help        =   '''
+                        Frames per second of the animated PNG.
+                        ''')
+
+    parser.add_argument('--cache',
+        type        =   str,
+        required    =   False,
+        help        =   '''
+                        Directory for cached simulation results of
+                        seeded 'range' sweeps. Repeated sweeps with the
+                        same settings and --seed load their results
+                        from there instead of simulating again.
+                        ''')
+
+    parser.add_argument('--cache-size',
+        type        =   float,
+        required    =   False,
+        default     =   1024,
+        help        =   '''
+                        Size limit of the cache directory in MB.
+                        Least recently used results are deleted
+                        first.
+                        ''')
+
+    parser.add_argument('--seed',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Seed for the simulation. Runs with the same
+                        seed and settings give the same images for
+                        any --batch; seeded sweeps go to the simulator
+                        in units of a fixed number of images.
+                        ''')
+
+    parser.add_argument('--profile',
+        type        =   str,
+        nargs       =   '?',
+        const       =   '',
+        required    =   False,
+        help        =   '''
+                        Report time and calls of every stage (Qiskit
+                        import, circuit construction, transpilation,
+                        simulation, conversion, assembly, encoding),
+                        the number
+                        of simulator calls and peak memory on stderr.
+                        Optionally also written to a JSON file.
+                        ''')
+
+    args = parser.parse_args()
+
+    # Argument 'seed' (non-negative integers only)
+    if args.seed is not None and args.seed < 0:
+        parser.error('argument --seed: must not be negative')
+
+    # Argument 'profile'
+    if args.profile is not None:
+        profile_enable()
+
+    # Create directory for output images
+    out_dir = 'experiment2_output'
+    path = os.path.join(os.getcwd(), out_dir)
     try:
         os.mkdir(path)
 
@@ -230,10 +338,61 @@ if args.method == 'range':
     except FileExistsError:
         pass
 
-    # Calculate decimal range
-    phases = np.linspace(0, 2.0, num=args.samples, endpoint=True)
+    # -----------------------------------------------------------------------------------
+
+    # Number of frames
+    n_frames = args.frames
+
+    # Argument 'episodic'
+    if args.method == 'episodic':
+        phase_as_str = str(args.phase).replace('.', 'pt')
+        sample_noise(args.phase, args.sidelength, n_frames, f"{path}/{args.method}_{phase_as_str}_{args.sidelength}x{args.sidelength}px.png", args.engine, args.seed)
+
+    # Argument 'range'
+    if args.method == 'range':
+
+        # Create directory for range (streamed outputs need none)
+        path = os.path.join(f"{os.getcwd()}/{out_dir}", f"{args.method}_{args.samples}_samples_{args.sidelength}x{args.sidelength}px")
+        try:
+            if args.output == 'png':
+                os.mkdir(path)
+
+        # Make sure directory does not get overwritten
+        except FileExistsError:
+            pass
+
+        # Calculate decimal range (enough decimals to tell the phases apart)
+        phases = np.linspace(0, 2.0, num=args.samples, endpoint=True)
+        decimals = 2
+        if args.samples > 1:
+            decimals = max(2, math.ceil(-math.log10(2.0 / (args.samples - 1))))
+
+        # Perform computation for all phases in range
+        paths = []
+        for i in range(len(phases)):
+            phase_as_str = str('{:.{}f}'.format(round(phases[i], decimals), decimals)).replace('.', 'pt')
+            paths.append(f"{path}/{args.method}_{phase_as_str}_{args.sidelength}x{args.sidelength}px.png")
+
+        # Argument 'apng'
+        if args.output == 'apng':
+            with ApngStream(f"{path}.png", args.sidelength, args.sidelength, len(phases) * n_frames, args.fps) as stream:
+                sample_noise_range(phases, args.sidelength, n_frames, paths, args.engine, args.batch, stream, args.cache, args.cache_size, args.seed)
+
+        # Argument 'raw'
+        elif args.output == 'raw':
+            with RawStream(sys.stdout.buffer) as stream:
+                sample_noise_range(phases, args.sidelength, n_frames, paths, args.engine, args.batch, stream, args.cache, args.cache_size, args.seed)
+
+        # Argument 'png'
+        else:
+            sample_noise_range(phases, args.sidelength, n_frames, paths, args.engine, args.batch, None, args.cache, args.cache_size, args.seed)
+
+    # Argument 'profile'
+    profile_report(args.profile)
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script (other modules import this file)
 
-    # Perform computation for every phase in range
-    for i in range(len(phases)):
-        phase_as_str = str('{:.2f}'.format(round(phases[i], 2))).replace('.', 'pt')
-        sample_noise(phases[i], args.sidelength, n_frames, f"{path}/{args.method}_{phase_as_str}_{args.sidelength}x{args.sidelength}px.png")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -5,19 +5,32 @@
 # INCLUDE ALL MODULES
 # -----------------------------------------------------------------------------------
 
-# Qiskit for Quantum computation
-from qiskit import QuantumCircuit, Aer, transpile, execute
-from qiskit.providers.aer.noise import NoiseModel, QuantumError, ReadoutError, pauli_error
+# Shared simulation core (cached noise model and backend)
+from simulation import load_qiskit, run_qc, run_qc_batch, register_layout, phase_circuit, sample_qc, derive_seed, seed_block, warm_up, SHOT_CHUNK, P_RESET, P_MEAS, P_GATE1, REGISTER_QUBITS
 
 # PILlow for image generation
 from PIL import Image, ImageColor
 
+# Shared image assembling
+from canvas import tiles_to_array, PngStream, MemmapCanvas, tiff_export
+
+# Shared result cache
+from cache import cache_key, cache_load, cache_store
+
+# Stage timers for --profile
+from profiling import stage, profile_enable, profile_call, profile_merge, profile_report
+
 # Handy math libraries
 import numpy as np
 import math
 
 # Command line arguments parsing
 import argparse
+from functools import partial
+
+# Process pool for band-wise processing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 
 # For saving files in current directory
 import os
@@ -26,66 +39,6 @@ import os
 # DEFINE ALL FUNCTIONS
 # -----------------------------------------------------------------------------------
 
-# Simulate Quantum computation
-
-def run_qc(circuit, backend, output, n_shots):
-
-    # -------------------------------------------------------------------------------
-    
-    # Build basic bit-flip error noise model
-
-    # Example error probabilities
-    p_reset = 0.03
-    p_meas = 0.1
-    p_gate1 = 0.05
-
-    # QuantumError objects
-    error_reset = pauli_error([('X', p_reset), ('I', 1 - p_reset)])
-    error_meas = pauli_error([('X',p_meas), ('I', 1 - p_meas)])
-    error_gate1 = pauli_error([('X',p_gate1), ('I', 1 - p_gate1)])
-    error_gate2 = error_gate1.tensor(error_gate1)
-
-    # Add errors to noise model
-    noise_bit_flip = NoiseModel()
-    noise_bit_flip.add_all_qubit_quantum_error(error_reset, "reset")
-    noise_bit_flip.add_all_qubit_quantum_error(error_meas, "measure")
-    noise_bit_flip.add_all_qubit_quantum_error(error_gate1, ["u1", "u2", "u3"])
-    noise_bit_flip.add_all_qubit_quantum_error(error_gate2, ["cx"])
-    
-    # -------------------------------------------------------------------------------
-    
-    # Execution and options
-    
-    # Load simulator (Aer)
-    backend_simulate = Aer.get_backend('aer_simulator')
-    
-    # Execute on Aer
-    if (backend == 'sim'):
-        run = execute(circuit,
-                      backend_simulate,
-                      shots = n_shots,
-                      memory = True).result()
-        if (output == 'count'):
-            out = run.get_counts()
-        if (output == 'memory'):
-            out = run.get_memory()
-    
-    # Execute on Aer + noise model
-    if (backend == 'sim_noise'):
-        run = execute(circuit,
-                      backend_simulate,
-                      noise_model=noise_bit_flip,
-                      shots = n_shots,
-                      memory = True).result()
-        if (output == 'count'):
-            out = run.get_counts()
-        if (output == 'memory'):
-            out = run.get_memory()
-
-    return out
-
-# -----------------------------------------------------------------------------------
-
 # Map output values linear accoring to input values of x
 
 def lin_map(x, in_min, in_max, out_min, out_max):
@@ -96,222 +49,699 @@ def lin_map(x, in_min, in_max, out_min, out_max):
 
 # -----------------------------------------------------------------------------------
 
-# Retrieving input image data
+# Decoding input image into an array of pixel values (rows, columns, colors)
+#
+# The image is opened once. Greyscale images keep a single color, 16 bit images
+# are scaled to 0..255 and everything else is read as RGB. With size, the image
+# is scaled down to that width while decoding (JPEG draft mode, then whole-factor
+# reduce) and only resized for what is left.
+
+def img_array(path, size=None):
+
+    with stage('input'):
+        img = Image.open(path)
+
+        # Argument 'size' (JPEG decoding at a smaller scale)
+        if size and img.width > size:
+            img.draft(img.mode, (size, size * img.height // img.width))
+
+        # Greyscale (8 bit, 16 bit, float) or RGB, the modes reduce and resize work on
+        if img.mode.startswith('I;16'):
+            img = img.convert('I')
+        elif img.mode in ('1', 'LA'):
+            img = img.convert('L')
+        elif img.mode not in ('L', 'I', 'F', 'RGB'):
+            img = img.convert('RGB')
+
+        # Argument 'size'
+        if size and img.width > size:
+            if img.width // size > 1:
+                img = img.reduce(img.width // size)
+            if img.width != size:
+                img = img.resize((size, max(round(img.height * size / img.width), 1)), Image.BOX)
+
+        # 16 bit and float greyscale
+        if img.mode == 'I':
+            data = np.asarray(img, dtype=float) * 255 / 65535
+        elif img.mode == 'F':
+            data = np.clip(np.asarray(img), 0, 255)
+
+        # 8 bit greyscale and RGB
+        else:
+            data = np.asarray(img)
+
+    return data.reshape(data.shape[0], data.shape[1], -1)
 
-def img_data(path):
+# -----------------------------------------------------------------------------------
 
-    img = Image.open(path).getdata()
-    px_rgb_vals = list(img)
-    
-    return px_rgb_vals
+# Values of the selected channel (or tuple of channels) of an image array, one row
+# per pixel in the order of Image.getdata(); greyscale images serve every channel
+
+def img_channels(data, channel):
+    channels = list(channel) if isinstance(channel, tuple) else [channel]
+    if data.shape[2] == 1:
+        channels = [0] * len(channels)
+
+    return data[:, :, channels].reshape(-1, len(channels))
 
 # -----------------------------------------------------------------------------------
 
-# Output image generating
+# Channel argument of the processing functions for data from img_channels
+
+def selected_channel(channel):
+    return tuple(range(len(channel))) if isinstance(channel, tuple) else 0
 
-def img_generating(data_vals, path):
-    a = int(len(data_vals) ** (1/2))
-    b = int(len(data_vals) ** (1/2))
-    c = int(len(data_vals[0]))
-    d = int(len(data_vals[0][0]))
-    img = Image.new('RGB', (a * c, b * d))
+# -----------------------------------------------------------------------------------
 
-    for i in range(a):
-        for j in range(b):
-            for k in range(c):
-                for l in range(d):
-                    color = int(data_vals[j + (a * i)][k][l] * 255) # [npatch index][npatch col][npatch row]
-                    img.putpixel(((k + (j * c)), l + (i * d)), (color, color, color)) # (x, y, rgb color)
+# Retrieving input image data of the selected channel
 
-    #img.show()
-    img.save(path)
+def img_data(path, channel=0, size=None):
+    return img_channels(img_array(path, size), channel)
 
 # -----------------------------------------------------------------------------------
 
 # Serial input and output data processing
 
-def serial_qc_processing(data_in, size_npatch, channel):
-    a = int(len(data_in) ** (1/2))
-    
-    data_out = []
-    qb = 1
+def serial_qc_processing(data_in, size_npatch, channel, batch_size=1, seed=None):
+    n_px = len(data_in)
 
-    for i in range(a ** 2):
-        c_to_rad = lin_map(data_in[i][channel], 0, 255, 1.5, 0.5)
-
-        # Quantum circuit
-        qc = QuantumCircuit(qb)
-        qc.reset(0)
-        qc.h(0)
-        qc.ry(math.pi * c_to_rad, 0)
-        qc.measure_all()
+    # Quantum circuits
+    load_qiskit()
+    circuits = []
+    with stage('circuit'):
+        for i in range(n_px):
+            c_to_rad = lin_map(data_in[i][channel], 0, 255, 1.5, 0.5)
+            circuits.append(phase_circuit(c_to_rad))
         
-        # Measurements
-        result = run_qc(qc, 'sim_noise', 'memory', size_npatch ** 2)
+    # Measurements (batch_size circuits per simulator call)
+    results = run_qc_batch(circuits, 'sim_noise', 'bits', size_npatch ** 2, batch_size, seed)
 
-        # Output data formatting
-        result = np.reshape(result, (size_npatch, size_npatch)).astype(float)
-        data_out.append(result)
+    # Output data formatting
+    data_out = np.reshape(results, (n_px, size_npatch, size_npatch))
         
     return data_out
 
 # -----------------------------------------------------------------------------------
 
-# Parallel input and output data processing
+# Serial processing of a whole image simulating every distinct intensity level only
+# once, called like the other processing functions for the bands of that image
+#
+# values holds the selected channel values of the whole image (see img_channels).
+# Pixels are grouped by level over all of it: the shots of a level are one stream,
+# seeded by the level and simulated in chunks of whole pixels as the bands need
+# them, and every pixel takes the block of shots of its rank within its level. So
+# there is one simulator call per level and chunk, and the output does not depend
+# on the bands. The latest chunk of every level is kept in memory.
+
+class LevelShots:
+
+    def __init__(self, values, size_npatch, seed=None):
+        self.values = np.asarray(values).reshape(-1)
+        self.size_npatch = size_npatch
+        self.seed = seed
+
+        # Distinct levels and pixels per chunk of a level
+        self.levels, self.counts = np.unique(self.values, return_counts=True)
+        self.chunk_px = max(SHOT_CHUNK // size_npatch ** 2, 1)
+        self.chunks = {}
+
+        # Values handed out so far, in all and per level
+        self.start = 0
+        self.taken = np.zeros(len(self.levels), dtype=np.int64)
+
+    def __call__(self, data_in, size_npatch, channel, seed=None, row=0, width=None):
+        data_in = np.asarray(data_in)
+        values = data_in.reshape(-1)
+
+        # Ranks within their levels of all values before these (bands out of order)
+        start = row * (width if width else len(data_in)) * data_in.shape[1]
+        if start != self.start:
+            self.taken = np.bincount(np.searchsorted(self.levels, self.values[:start]), minlength=len(self.levels))
+
+        data_out = np.empty((len(values), size_npatch ** 2), dtype=np.uint8)
+        index = np.searchsorted(self.levels, values)
+        for k in np.unique(index):
+            pixels = np.flatnonzero(index == k)
+            data_out[pixels] = self.level_shots(k, self.taken[k], len(pixels))
+            self.taken[k] += len(pixels)
+        self.start = start + len(values)
+
+        # Output data formatting ([pixel][color][col][row] for several channels)
+        if isinstance(channel, tuple):
+            return np.reshape(data_out, (len(data_in), len(channel), size_npatch, size_npatch))
+        return np.reshape(data_out, (len(data_in), size_npatch, size_npatch))
+
+    # Shots of n pixels of level k from rank on, one row per pixel
+
+    def level_shots(self, k, rank, n):
+        shots = []
+        while n:
+            j, first = divmod(rank, self.chunk_px)
+            shots.append(self.level_chunk(k, j)[first:first + n])
+            rank += len(shots[-1])
+            n -= len(shots[-1])
+
+        return np.concatenate(shots)
+
+    # Chunk j of the shots of level k
+
+    def level_chunk(self, k, j):
+        if k in self.chunks and self.chunks[k][0] == j:
+            return self.chunks[k][1]
+
+        level = self.levels[k]
+        n_px = min(self.chunk_px, int(self.counts[k]) - j * self.chunk_px)
+
+        load_qiskit()
+        with stage('circuit'):
+            c_to_rad = lin_map(level, 0, 255, 1.5, 0.5)
+            qc = phase_circuit(c_to_rad)
+
+        # Sub-seed by level (fractional levels of 16 bit images by their bits) and chunk
+        index = int(level) if level == int(level) else int(np.float64(level).view(np.uint64))
+        result = run_qc(qc, 'sim_noise', 'bits', n_px * self.size_npatch ** 2, derive_seed(self.seed, index, j))
+
+        self.chunks[k] = (j, np.reshape(result, (n_px, self.size_npatch ** 2)))
+        return self.chunks[k][1]
 
-def parallel_qc_processing(data_in, size_npatch, channel):
-    data_out = []
-    qb = len(data_in)
+# -----------------------------------------------------------------------------------
+
+# Input and output data processing with the analytic engine (no Aer)
 
-    # Quantum circuit
-    qc = QuantumCircuit(qb)
-    for i in range(qb):
-        c_to_rad = lin_map(data_in[i][channel], 0, 255, 1.5, 0.5)
-        qc.reset(i)
-        qc.h(i)
-        qc.ry(math.pi * c_to_rad, i)
-    qc.measure_all()
+def analytic_qc_processing(data_in, size_npatch, channel, seed=None):
+    n_px = len(data_in)
+
+    # Phases of all pixels at once
+    c_to_rad = lin_map(np.asarray(data_in)[:, channel], 0, 255, 1.5, 0.5)
 
     # Measurements
-    result = run_qc(qc, 'sim_noise', 'memory', size_npatch ** 2)
+    result = sample_qc(c_to_rad, 'sim_noise', size_npatch ** 2, seed=seed)
 
     # Output data formatting
-    for j in range(qb):
-        result_form = []
-        for k in range(size_npatch ** 2):
-            result_form.append(result[k][j]) # ['[0123]']
+    data_out = np.reshape(result, (n_px, size_npatch, size_npatch))
+
+    return data_out
+
+# -----------------------------------------------------------------------------------
 
-        result_form = np.reshape(result_form, (size_npatch, size_npatch)).astype(float)
-        data_out.append(result_form)
+# Parallel input and output data processing
+
+def parallel_qc_processing(data_in, size_npatch, channel, budget_mb=256, seed=None):
+    data_out = []
+
+    # Split pixels into registers of qb qubits, batch_size registers per simulator call
+    qb, batch_size = register_layout(size_npatch ** 2, budget_mb)
+
+    # Seeded units keep registers of a fixed size, so the output does not depend on the budget
+    if seed is not None:
+        qb = REGISTER_QUBITS
+
+    # Quantum circuits
+    load_qiskit()
+    from qiskit import QuantumCircuit
+
+    circuits = []
+    with stage('circuit'):
+        for start in range(0, len(data_in), qb):
+            n = min(qb, len(data_in) - start)
+            qc = QuantumCircuit(n)
+            for i in range(n):
+                c_to_rad = lin_map(data_in[start + i][channel], 0, 255, 1.5, 0.5)
+                qc.reset(i)
+                qc.h(i)
+                qc.ry(math.pi * c_to_rad, i)
+            qc.measure_all()
+            circuits.append(qc)
+
+    # Measurements
+    results = run_qc_batch(circuits, 'sim_noise', 'bits', size_npatch ** 2, batch_size, seed)
 
-    data_out.reverse()
+    # Output data formatting (column i of a register holds the shots of pixel start + i)
+    for result in results:
+        data_out.append(result.T)
+    data_out = np.reshape(np.concatenate(data_out), (len(data_in), size_npatch, size_npatch))
     
     return data_out
 
 # -----------------------------------------------------------------------------------
-# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+
+# Process several color channels of every pixel in one pass
+
+def channels_qc_processing(data_in, size_npatch, channels, process, seed=None):
+
+    # Every channel value becomes a pixel of its own, ordered pixel by pixel
+    data_ch = np.asarray(data_in)[:, list(channels)].reshape(-1, 1)
+    data_out = process(data_ch, size_npatch, 0, seed=seed)
+
+    # Output data formatting ([pixel][color][col][row])
+    data_out = np.reshape(data_out, (len(data_in), len(channels), size_npatch, size_npatch))
+
+    return data_out
+
 # -----------------------------------------------------------------------------------
 
+# Processing in seeded units
+#
+# data_in holds rows of width pixels, starting at image row row. Every row is cut
+# into segments of seed_block pixels, each processed on its own with a sub-seed of
+# the global seed, its row and its segment index, so the output of a seeded run
+# does not depend on bands, workers, batches or the memory budget. Unseeded data
+# is processed in one call.
 
-# Argument parsing from command line
-parser = argparse.ArgumentParser(
-    description =   '''
-                    Use this piece of software to process raster
-                    images by simulating, visualizing and shifting
-                    superposition according to color pixel values
-                    of an image instead of defined phases.
-                    ''',
-    epilog      =   '''
-                    Your created noise image will
-                    be filed in a directory that sits
-                    in the same place as this program.
-                    ''')
-
-parser.add_argument('--input',
-    type        =   str,
-    required    =   True,
-    help        =   '''
-                    Insert the *absolute* path of your input
-                    image. The input image must be *squared*!
-                    ''')
-
-parser.add_argument('--resolution',
-    type        =   int,
-    required    =   False,
-    help        =   '''
-                    This determines the desity of the noise
-                    pattern of each computed pixel.
-                    ''')
-
-parser.add_argument('--channel',
-    type        =   str,
-    required    =   False,
-    choices     =   ['r', 'g', 'b'],
-    help        =   '''
-                    If you want to process color images you
-                    need to compute each color channel (rgb)
-                    seperately.
-                    ''')
-
-parser.add_argument('--method',
-    type        =   str,
-    required    =   True,
-    choices     =   ['serial', 'parallel'],
-    help        =   '''
-                    Note that using 'parallel' instead of 'serial'
-                    makes no difference visually nor in performance.
-                    Memory can be easily exceeded by trying
-                    to process an image with a side length larger
-                    than 32 pixels using 'parallel' method.
-                    ''')
-
-args = parser.parse_args()
-
-# Create directory for output images
-out_dir = 'experiment3_output'
-path = os.path.join(os.getcwd(), out_dir)
-try:
-    os.mkdir(path)
-
-# Make sure directory does not get overwritten
-except FileExistsError:
-    pass
+def unit_qc_processing(data_in, size_npatch, channel, process, seed=None, row=0, width=None):
+    if seed is None:
+        return process(data_in, size_npatch, channel, seed=seed)
+
+    width = width if width else len(data_in)
+    block = seed_block(size_npatch ** 2)
+
+    data_out = []
+    for start in range(0, len(data_in), width):
+        for j in range(0, width, block):
+            unit = data_in[start + j:start + min(j + block, width)]
+            data_out.append(process(unit, size_npatch, channel, seed=derive_seed(seed, row + start // width, j // block)))
+
+    return np.concatenate(data_out)
 
 # -----------------------------------------------------------------------------------
 
-if args.method == 'serial' or args.method == 'parallel':
+# Processing with results cached on disk, keyed by input pixels and their position,
+# settings, noise model, resolution and seed
+#
+# Only seeded runs are cached: without a seed, bands of equal content would share
+# one entry and with it their noise.
 
-    img_test = Image.open(args.input).getdata()
-    w, h = img_test.size
-    if w != h:
-        print(
-            '''
-            The input image must me *squared*!
-            ''')
+def cached_qc_processing(data_in, size_npatch, channel, process, config, cache_dir, max_mb, seed=None, row=0, width=None):
+    if seed is None:
+        return process(data_in, size_npatch, channel, seed=seed, row=row, width=width)
 
-        exit()
+    key = cache_key(config, (P_RESET, P_MEAS, P_GATE1), np.asarray(data_in), row, width, size_npatch, channel, seed)
 
-    new_img = img_data(args.input)
-    size = len(new_img) 
+    with stage('cache'):
+        data_out = cache_load(cache_dir, key)
+    if data_out is None:
+        data_out = process(data_in, size_npatch, channel, seed=seed, row=row, width=width)
+        with stage('cache'):
+            cache_store(cache_dir, key, data_out, max_mb)
 
-    # Mapping arguments
-    channel = 0
-    resolution = args.resolution
+    return data_out
 
-    if args.resolution == None:
-        resolution = 2
-    if args.channel == 'r':
-        channel = 0
-    if args.channel == 'g':
-        channel = 1
-    if args.channel == 'b':
-        channel = 2
-    
-    if args.method == 'parallel' and int((size ** (1/2)) * 2) >= 64:
-        print(
-            '''
-            Executing this setting with parallel method
-            exceeds memory. Please try input image with
-            side length < 32px or execute with serial method.
-            ''')
+# -----------------------------------------------------------------------------------
+
+# Process one band of input pixel values (rows, columns, colors) into its rows of
+# the output image
+
+def render_band(data_band, row, size_npatch, channel, process, seed):
+    data_in = img_channels(data_band, channel)
+    data_out = process(data_in, size_npatch, selected_channel(channel), seed=seed, row=row, width=data_band.shape[1])
+
+    return tiles_to_array(data_out, data_band.shape[1])
+
+# -----------------------------------------------------------------------------------
+
+# Process input image data (rows, columns, colors, see img_array) in bands of pixel
+# rows, writing every finished band of the output straight to disk
+#
+# Pixels are seeded by their row and position in it (see unit_qc_processing), so
+# the output does not depend on the bands or the number of workers. Workers get the
+# pixel values of their band only and never decode the input image themselves.
+# With profile, workers send their stage timers back along with every band. Output
+# goes to a PNG stream, or with fmt 'npy' or 'tiff' to a memory-mapped canvas (see
+# MemmapCanvas) that an interrupted run with the same key (input and settings)
+# continues from its first unfinished band; 'tiff' is exported from it at the end.
+# With dedup, the levels of the whole image are simulated in this process (see
+# LevelShots) and the bands only assemble and write their shots. Workers warm up
+# their simulator with the 'aer' engine only.
+
+def stream_qc_processing(data, size_npatch, channel, process, band_rows, path, seed=None, workers=None, profile=False, fmt='png', key=None, dedup=False, engine='aer'):
+    h, w = data.shape[:2]
+    bands = [(r, min(r + band_rows, h)) for r in range(0, h, band_rows)]
+    colors = len(channel) if isinstance(channel, tuple) else 1
+
+    if fmt == 'png':
+        out = PngStream(path, w * size_npatch, h * size_npatch, colors)
+        first = 0
+    else:
+        out = MemmapCanvas(path if fmt == 'npy' else path + '.npy', w * size_npatch, h * size_npatch, colors, key)
+        first = sum(r_end * size_npatch <= out.rows for r_start, r_end in bands)
+        if first < len(bands):
+            out.seek(bands[first][0] * size_npatch)
+
+    # Argument 'dedup'
+    if dedup:
+        process = LevelShots(img_channels(data, channel), size_npatch, seed)
+        workers = None
+
+    with out:
+
+        # Single process
+        if not workers:
+            for t in range(first, len(bands)):
+                r_start, r_end = bands[t]
+                out.write(render_band(data[r_start:r_end], r_start, size_npatch, channel, process, seed))
+
+        # Process pool, every worker keeps its own warm simulator (Aer only)
+        else:
+            with ProcessPoolExecutor(workers, initializer=warm_up if engine == 'aer' else None) as pool:
+                pending = deque()
+                for t in range(first, len(bands)):
+                    r_start, r_end = bands[t]
+                    task = (render_band, data[r_start:r_end], r_start, size_npatch, channel, process, seed)
+                    pending.append(pool.submit(profile_call, *task) if profile else pool.submit(*task))
+
+                    # Write finished bands in order, keeping few of them in memory
+                    while len(pending) >= 2 * workers or (pending and pending[0].done()):
+                        out.write(band_result(pending.popleft(), profile))
+
+                while pending:
+                    out.write(band_result(pending.popleft(), profile))
+
+    # Argument 'format'
+    if fmt == 'tiff':
+        tiff_export(np.load(path + '.npy', mmap_mode='r'), path)
+        os.remove(path + '.npy')
+
+# -----------------------------------------------------------------------------------
+
+# Output rows of a finished band, merging the stage timers of its worker
+
+def band_result(future, profile):
+    if not profile:
+        return future.result()
 
-        exit()
+    rows, stats = future.result()
+    profile_merge(stats)
 
-    # side length and filename (input image) for naming (output image)
-    size = int((size * (args.resolution ** 2)) ** (1/2))
-    img_name = os.path.basename(args.input)[:-4]
+    return rows
 
-    # -------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------
+
+# Processing function for engine, method and options, called as
+# process(data_in, size_npatch, channel, seed=seed, row=row, width=width) with rows of
+# width pixels from image row row on (see unit_qc_processing)
+
+def qc_processing(engine, method, channel, batch=1024, memory=256, cache_dir=None, max_mb=1024):
 
-    # Process input image data
+    # Argument 'analytic'
+    if engine == 'analytic':
+        process = analytic_qc_processing
 
     # Argument 'serial'
-    if args.method == 'serial':
-        new_img = serial_qc_processing(new_img, resolution, channel)
+    elif method == 'serial':
+        process = partial(serial_qc_processing, batch_size=batch)
 
     # Argument 'parallel'
-    if args.method == 'parallel':
-        new_img = parallel_qc_processing(new_img, args.resolution, channel)
+    elif method == 'parallel':
+        process = partial(parallel_qc_processing, budget_mb=memory)
+
+    # Argument 'rgb'
+    if isinstance(channel, tuple):
+        process = partial(channels_qc_processing, process=process)
+
+    # Argument 'seed'
+    process = partial(unit_qc_processing, process=process)
+
+    # Argument 'cache' (seeded output does not depend on batch and memory)
+    if cache_dir:
+        config = method if engine == 'aer' else engine
+        process = partial(cached_qc_processing, process=process, config=config, cache_dir=cache_dir, max_mb=max_mb)
+
+    return process
+
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
+
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to process raster
+                        images by simulating, visualizing and shifting
+                        superposition according to color pixel values
+                        of an image instead of defined phases.
+                        ''',
+        epilog      =   '''
+                        Your created noise image will
+                        be filed in a directory that sits
+                        in the same place as this program.
+                        ''')
+
+    parser.add_argument('--input',
+        type        =   str,
+        required    =   True,
+        help        =   '''
+                        Insert the *absolute* path of your input
+                        image. The input image must be *squared*!
+                        ''')
+
+    parser.add_argument('--resolution',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        This determines the desity of the noise
+                        pattern of each computed pixel.
+                        ''')
+
+    parser.add_argument('--channel',
+        type        =   str,
+        required    =   False,
+        choices     =   ['r', 'g', 'b', 'rgb'],
+        help        =   '''
+                        If you want to process color images you
+                        can compute each color channel (r, g, b)
+                        seperately or all of them at once (rgb)
+                        for a color noise image.
+                        ''')
+
+    parser.add_argument('--method',
+        type        =   str,
+        required    =   True,
+        choices     =   ['serial', 'parallel'],
+        help        =   '''
+                        Using 'parallel' instead of 'serial' makes no
+                        difference visually. 'parallel' puts several
+                        pixels on the qubits of one circuit, sized by
+                        the --memory budget.
+                        ''')
+
+    parser.add_argument('--memory',
+        type        =   float,
+        required    =   False,
+        default     =   256,
+        help        =   '''
+                        Memory budget in MB for a single simulator
+                        call using 'parallel' method. Determines how
+                        many qubits share a circuit and how many
+                        circuits are sent to the simulator at once.
+                        ''')
+
+    parser.add_argument('--batch',
+        type        =   int,
+        required    =   False,
+        default     =   1024,
+        help        =   '''
+                        Number of pixel circuits that are sent to
+                        the simulator at once using 'serial' method.
+                        Use 0 to send all circuits in a single call.
+                        Smaller batches keep memory usage low.
+                        ''')
+
+    parser.add_argument('--dedup',
+        action      =   'store_true',
+        help        =   '''
+                        Using 'serial' method, simulate every
+                        distinct intensity level of the input
+                        image only once and share its shots among
+                        all pixels of that level. Much faster for
+                        images with few distinct levels. Runs in
+                        one process and is not cached.
+                        ''')
+
+    parser.add_argument('--engine',
+        type        =   str,
+        required    =   False,
+        default     =   'aer',
+        choices     =   ['aer', 'analytic'],
+        help        =   '''
+                        Simulate circuits with 'aer' (default) or
+                        draw the shots of all pixels from their
+                        exact outcome probabilities, including the
+                        noise model, with 'analytic'. The latter
+                        ignores --method and is much faster.
+                        ''')
+
+    parser.add_argument('--size',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Scale the input image down to this side
+                        length while decoding. Much faster than
+                        decoding large photos in full.
+                        ''')
+
+    parser.add_argument('--band',
+        type        =   int,
+        required    =   False,
+        default     =   8,
+        help        =   '''
+                        The input image is processed in bands of this
+                        many pixel rows (default 8), each finished
+                        band is written straight to disk. Keeps memory
+                        usage bounded for large images and resolutions.
+                        ''')
+
+    parser.add_argument('--workers',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Spread the bands of the input image over this
+                        many processes. With the same --seed and
+                        --band, the output is identical for any
+                        number of workers, or none.
+                        ''')
+
+    parser.add_argument('--format',
+        type        =   str,
+        required    =   False,
+        default     =   'png',
+        choices     =   ['png', 'tiff', 'npy'],
+        help        =   '''
+                        Output file format. 'tiff' (tiled) and 'npy'
+                        assemble the output in a file on disk instead
+                        of memory, so its size is only limited by
+                        disk space. An interrupted run continues
+                        where it stopped when started again with
+                        the same input, settings and --seed, and
+                        starts over otherwise.
+                        ''')
+
+    parser.add_argument('--seed',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Seed for the simulation. Runs with the same
+                        seed and settings give the same image for any
+                        --band, --workers, --batch and --memory;
+                        seeded runs send the pixels to the simulator
+                        in units of a fixed size per image row.
+                        ''')
+
+    parser.add_argument('--cache',
+        type        =   str,
+        required    =   False,
+        help        =   '''
+                        Directory for cached simulation results of
+                        seeded runs. Repeated runs with the same
+                        input, settings and --seed load their results
+                        from there instead of simulating again.
+                        ''')
+
+    parser.add_argument('--cache-size',
+        type        =   float,
+        required    =   False,
+        default     =   1024,
+        help        =   '''
+                        Size limit of the cache directory in MB.
+                        Least recently used results are deleted
+                        first.
+                        ''')
+
+    parser.add_argument('--profile',
+        type        =   str,
+        nargs       =   '?',
+        const       =   '',
+        required    =   False,
+        help        =   '''
+                        Report time and calls of every stage (Qiskit
+                        import, circuit construction, transpilation,
+                        simulation, conversion, assembly, encoding),
+                        the number
+                        of simulator calls and peak memory on stderr.
+                        Optionally also written to a JSON file.
+                        ''')
+
+    args = parser.parse_args()
+
+    # Argument 'seed' (non-negative integers only)
+    if args.seed is not None and args.seed < 0:
+        parser.error('argument --seed: must not be negative')
+
+    # Argument 'band'
+    if args.band < 1:
+        parser.error('argument --band: must be at least 1')
+
+    # Argument 'profile'
+    if args.profile is not None:
+        profile_enable()
+
+    # Create directory for output images
+    out_dir = 'experiment3_output'
+    path = os.path.join(os.getcwd(), out_dir)
+    try:
+        os.mkdir(path)
+
+    # Make sure directory does not get overwritten
+    except FileExistsError:
+        pass
+
+    # -----------------------------------------------------------------------------------
+
+    if args.method == 'serial' or args.method == 'parallel':
+
+        # Decoded once, shared with the processing below
+        data = img_array(args.input, args.size)
+        h, w = data.shape[:2]
+        if w != h:
+            print(
+                '''
+                The input image must me *squared*!
+                ''')
+
+            exit()
+
+        # Mapping arguments
+        channel = 0
+        resolution = args.resolution
+
+        if args.resolution == None:
+            resolution = 2
+        if args.channel == 'r':
+            channel = 0
+        if args.channel == 'g':
+            channel = 1
+        if args.channel == 'b':
+            channel = 2
+        if args.channel == 'rgb':
+            channel = (0, 1, 2)
     
-    # Generate output image
-    img_generating(new_img, f"{path}/{img_name}_{args.method}_{size}x{size}px.png")
\ No newline at end of file
+        # side length and filename (input image) for naming (output image)
+        size = w * resolution
+        img_name = os.path.basename(args.input)[:-4]
+        method = args.method if args.engine == 'aer' else args.engine
+
+        # ---------------------------------------------------------------------------
+
+        # Process input image data
+        process = qc_processing(args.engine, args.method, channel, args.batch, args.memory, args.cache, args.cache_size)
+        dedup = args.dedup and args.engine == 'aer' and args.method == 'serial'
+
+        # Interrupted renders only continue with the same input and settings
+        key = cache_key('render', data, resolution, channel, method, dedup, (P_RESET, P_MEAS, P_GATE1), args.seed)
+
+        # Process input image data band by band (arguments 'band', 'workers', 'format')
+        ext = {'png': 'png', 'tiff': 'tif', 'npy': 'npy'}[args.format]
+        stream_qc_processing(data, resolution, channel, process, args.band, f"{path}/{img_name}_{method}_{size}x{size}px.{ext}", args.seed, args.workers, args.profile is not None, args.format, key, dedup, args.engine)
+
+        # Argument 'profile'
+        profile_report(args.profile)
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script (worker processes and other modules import this file)
+
+if __name__ == '__main__':
+    main()
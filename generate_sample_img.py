@@ -8,6 +8,13 @@
 # PILlow for image generation
 from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageOps
 
+# Handy math libraries
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Parallel file writing
+from concurrent.futures import ThreadPoolExecutor
+
 # Command line arguments parsing
 import argparse
 
@@ -18,227 +25,249 @@ import os
 # DEFINE ALL FUNCTIONS
 # -----------------------------------------------------------------------------------
 
-# Base funtions
+# Base funtions (element-wise on NumPy arrays)
 
 def lin_map(x, in_min, in_max, out_min, out_max):
     if in_min == in_max:
-        return out_max / 2
+        return out_max / 2 + np.zeros_like(x, dtype=float)
     else:
         return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
 def step(x, w, out_min, out_max):
-    if x < w / 2:
-        return out_min
-    if x >= w / 2:
-        return out_max
+    return np.where(x < w / 2, out_min, out_max)
 
 def step_div(x, y, w, out_min, out_max):
-    if x < w / 2 and y < w / 2 or x >= w / 2 and y >= w / 2:
-        return out_max
-    if x < w / 2 and y >= w / 2 or x >= w / 2 and y < w / 2:
-        return out_min
+    return np.where((x < w / 2) == (y < w / 2), out_max, out_min)
 
 def dist(x, y):
     return (x - (y - 1) / 2) ** 2
 
 # -----------------------------------------------------------------------------------
 
+# Canvas whose pixel (x, y) is t[x] (same value in every row), no copy
+
+def canvas_orth(t):
+    return np.broadcast_to(t, (len(t), len(t)))
+
+# -----------------------------------------------------------------------------------
+
+# Canvas whose pixel (x, y) is t[x + y] (2a - 1 values), no copy
+
+def canvas_dia(t):
+    return sliding_window_view(t, (len(t) + 1) // 2)
+
+# -----------------------------------------------------------------------------------
+
+# Write greyscale canvases as RGB images into path, all files at once (threads of
+# pool if given, returning their futures)
+
+def save_img(grey, path):
+    channel = Image.fromarray(np.ascontiguousarray(grey, dtype=np.uint8))
+    Image.merge('RGB', (channel, channel, channel)).save(path)
+
+def save_imgs(imgs, path, pool=None):
+    if pool:
+        return [pool.submit(save_img, grey, os.path.join(path, name)) for grey, name in imgs]
+
+    with ThreadPoolExecutor(max(len(imgs), 1)) as pool:
+        list(pool.map(lambda img: save_img(img[0], os.path.join(path, img[1])), imgs))
+
+    return []
+
+# -----------------------------------------------------------------------------------
+
 # Generate sample images using base functions above
+#
+# Every generator returns its canvases (uint8, greyscale) with their file names;
+# nothing is written here. Every canvas is computed as a whole; rotations are array
+# rotations (views), each one turning the previous canvas further by 90, 180 and
+# 270 degrees.
+
+def rotations(c, name, a, turns=(1, 2, 3)):
+    imgs = [(c, f'sample_{name}_0_{a}x{a}px.png')]
+    k = 0
+    for turn in turns:
+        k += turn
+        imgs.append((np.rot90(c, k), f'sample_{name}_{90 * turn}_{a}x{a}px.png'))
+
+    return imgs
+
+# -----------------------------------------------------------------------------------
 
 # Linear interpolation, orthogonal
 
-def cont_interp_orth(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = int(lin_map(i, 0, a, 0, 255))
-            img.putpixel((i, j), (c, c, c))
+def cont_interp_orth(a):
+    c = canvas_orth(lin_map(np.arange(a), 0, a, 0, 255).astype(np.uint8))
 
-    #img.show()
-    img.save(f'{path}/sample_cont_interp_orth_0_{a}x{a}px.png')
-    img = img.rotate(90)
-    img.save(f'{path}/sample_cont_interp_orth_90_{a}x{a}px.png')
-    img = img.rotate(180)
-    img.save(f'{path}/sample_cont_interp_orth_180_{a}x{a}px.png')
-    img = img.rotate(270)
-    img.save(f'{path}/sample_cont_interp_orth_270_{a}x{a}px.png')
+    return rotations(c, 'cont_interp_orth', a)
 
 # -----------------------------------------------------------------------------------
 
 # Linear interpolation diagonal
 
-def cont_interp_dia(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = int(lin_map((i + j) / 2, 0, a, 0, 255))
-            img.putpixel((i, j), (c, c, c))
+def cont_interp_dia(a):
+    c = canvas_dia(lin_map(np.arange(2 * a - 1) / 2, 0, a, 0, 255).astype(np.uint8))
 
-    #img.show()
-    img.save(f'{path}/sample_cont_interp_dia_0_{a}x{a}px.png')
-    img = img.rotate(90)
-    img.save(f'{path}/sample_cont_interp_dia_90_{a}x{a}px.png')
-    img = img.rotate(180)
-    img.save(f'{path}/sample_cont_interp_dia_180_{a}x{a}px.png')
-    img = img.rotate(270)
-    img.save(f'{path}/sample_cont_interp_dia_270_{a}x{a}px.png')
+    return rotations(c, 'cont_interp_dia', a)
 
 # -----------------------------------------------------------------------------------
 
-# Radial gradient
+# Radial gradient (computed in bands of rows to bound temporary memory)
 
-def cont_interp_rad(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            d = lin_map(dist(i, a) + dist(j, a), dist(a / 2, a) * 2, dist(0, a) * 2, 0, 1)
-            d = d ** (1 / 2)
-            color = int(d * 255)
-            img.putpixel((i, j), (color, color, color))
+def cont_interp_rad(a):
+    x = dist(np.arange(a), a)
+    c = np.empty((a, a), dtype=np.uint8)
+
+    rows = max(2 ** 22 // a, 1)
+    for r in range(0, a, rows):
+        d = lin_map(x[None, :] + x[r:r + rows, None], dist(a / 2, a) * 2, dist(0, a) * 2, 0, 1)
+
+        # The center pixel of odd canvases lies closer than the nearest even one
+        d = np.maximum(d, 0) ** (1 / 2)
+        c[r:r + rows] = d * 255
 
     #img.show()
-    img.save(f'{path}/sample_cont_interp_rad_{a}x{a}px.png')
-    img = ImageOps.invert(img)
-    img.save(f'{path}/sample_cont_interp_rad_inv_{a}x{a}px.png')
+    return [(c, f'sample_cont_interp_rad_{a}x{a}px.png'),
+            (255 - c, f'sample_cont_interp_rad_inv_{a}x{a}px.png')]
 
 # -----------------------------------------------------------------------------------
 
 # Step orthogonal
 
-def disc_orth(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = int(step(i, a, 0, 255))
-            img.putpixel((i, j), (c, c, c))
+def disc_orth(a):
+    c = canvas_orth(step(np.arange(a), a, 0, 255).astype(np.uint8))
 
-    #img.show()
-    img.save(f'{path}/sample_disc_orth_0_{a}x{a}px.png')
-    img = img.rotate(90)
-    img.save(f'{path}/sample_disc_orth_90_{a}x{a}px.png')
-    img = img.rotate(180)
-    img.save(f'{path}/sample_disc_orth_180_{a}x{a}px.png')
-    img = img.rotate(270)
-    img.save(f'{path}/sample_disc_orth_270_{a}x{a}px.png')
+    return rotations(c, 'disc_orth', a)
 
 # -----------------------------------------------------------------------------------
 
 # Step diagonal
 
-def disc_dia(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = int(step((i + j) / 2, a, 0, 255))
-            img.putpixel((i, j), (c, c, c))
+def disc_dia(a):
+    c = canvas_dia(step(np.arange(2 * a - 1) / 2, a, 0, 255).astype(np.uint8))
 
-    #img.show()
-    img.save(f'{path}/sample_disc_dia_0_{a}x{a}px.png')
-    img = img.rotate(90)
-    img.save(f'{path}/sample_disc_dia_90_{a}x{a}px.png')
-    img = img.rotate(180)
-    img.save(f'{path}/sample_disc_dia_180_{a}x{a}px.png')
-    img = img.rotate(270)
-    img.save(f'{path}/sample_disc_dia_270_{a}x{a}px.png')
+    return rotations(c, 'disc_dia', a)
 
 # -----------------------------------------------------------------------------------
 
 # Checkerboard pattern
 
-def disc_checker(a, path):
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = int(step_div(i, j, a, 0, 255))
-            img.putpixel((i, j), (c, c, c))
+def disc_checker(a):
+    c = step_div(np.arange(a)[None, :], np.arange(a)[:, None], a, 0, 255).astype(np.uint8)
 
-    #img.show()
-    img.save(f'{path}/sample_disc_checker_0_{a}x{a}px.png')
-    img = img.rotate(90)
-    img.save(f'{path}/sample_disc_checker_90_{a}x{a}px.png')
+    return rotations(c, 'disc_checker', a, turns=(1,))
 
 # -----------------------------------------------------------------------------------
 
-# Alphanumeric
+# Alphanumeric (white canvas, text drawn by Pillow)
 
-def alphanum(txt, a, path):
+def alphanum(txt, a):
     font = ImageFont.truetype("Inter-Regular.ttf", a)
 
-    img = Image.new('RGB', (a, a))
-    for i in range(a):
-        for j in range(a):
-            c = 255
-            img.putpixel((i, j), (c, c, c))
+    img = Image.new('L', (a, a), 255)
 
     draw = ImageDraw.Draw(img)
-    draw.text(((a/2) - (font.getbbox(txt)[2]/2), (a/2) - ((font.getbbox(txt)[1] + font.getbbox(txt)[3])/2)), txt, (0, 0, 0), font)
+    draw.text(((a/2) - (font.getbbox(txt)[2]/2), (a/2) - ((font.getbbox(txt)[1] + font.getbbox(txt)[3])/2)), txt, 0, font)
 
     #img.show()
-    img.save(f'{path}/sample_alphanum_{txt}_{a}x{a}px.png')
-    img = ImageOps.invert(img)
-    img.save(f'{path}/sample_alphanum_{txt}_inv_{a}x{a}px.png')
+    c = np.asarray(img)
+    return [(c, f'sample_alphanum_{txt}_{a}x{a}px.png'),
+            (255 - c, f'sample_alphanum_{txt}_inv_{a}x{a}px.png')]
 
 # -----------------------------------------------------------------------------------
-# CALL FUNCTIONS ACCORDING TO ARGUMENTS
-# -----------------------------------------------------------------------------------
 
-# Argument parsing from command line
-parser = argparse.ArgumentParser(
-    description =   '''
-                    Use this piece of software to automatically
-                    create an array of different sample images
-                    to test in experiment3.py. 
-                    ''',
-    epilog      =   '''
-                    Your created sample images will
-                    be filed in a directory that sits
-                    in the same place as this program.
-                    ''')
+# All sample canvases of side length a with their file names, one pattern at a time
 
-parser.add_argument('--sidelength',
-    type        =   int,
-    required    =   True,
-    help        =   '''
-                    Specify a common side length of the
-                    sample images as an integer such as 4.
-                    ''')
+def sample_imgs(a, txt="A"):
 
-args = parser.parse_args()
+    # Discrete
+    yield from disc_orth(a)
+    yield from disc_dia(a)
+    yield from disc_checker(a)
 
-# Create directory for output images
-out_dir = 'sample_img'
-path = os.path.join(os.getcwd(), out_dir)
-try:
-    os.mkdir(path)
+    # Continuous
+    yield from cont_interp_orth(a)
+    yield from cont_interp_dia(a)
+    yield from cont_interp_rad(a)
 
-# Make sure directory does not get overwritten
-except FileExistsError:
-    pass
+    # Alphanumeric
+    yield from alphanum(txt, a)
 
 # -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
 
-# Generate images
-
-a = args.sidelength
-
-# Create directory for each size
-path = os.path.join(path, f"{a}x{a}")
-try:
-    os.mkdir(path)
-
-# Make sure directory does not get overwritten
-except FileExistsError:
-    pass
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to automatically
+                        create an array of different sample images
+                        to test in experiment3.py. 
+                        ''',
+        epilog      =   '''
+                        Your created sample images will
+                        be filed in a directory that sits
+                        in the same place as this program.
+                        ''')
+
+    parser.add_argument('--sidelength',
+        type        =   int,
+        required    =   True,
+        help        =   '''
+                        Specify a common side length of the
+                        sample images as an integer such as 4.
+                        ''')
+
+    parser.add_argument('--workers',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Number of image files written at the same
+                        time (default depends on the number of CPUs).
+                        ''')
+
+    args = parser.parse_args()
+
+    # Create directory for output images
+    out_dir = 'sample_img'
+    path = os.path.join(os.getcwd(), out_dir)
+    try:
+        os.mkdir(path)
+
+    # Make sure directory does not get overwritten
+    except FileExistsError:
+        pass
+
+    # -----------------------------------------------------------------------------------
+
+    # Generate images
+
+    a = args.sidelength
+
+    # Create directory for each size
+    path = os.path.join(path, f"{a}x{a}")
+    try:
+        os.mkdir(path)
+
+    # Make sure directory does not get overwritten
+    except FileExistsError:
+        pass
+
+    # All files written in parallel
+    with ThreadPoolExecutor(args.workers) as pool:
+        writes = save_imgs(list(sample_imgs(a)), path, pool)
+
+        # Raise errors of any write
+        for write in writes:
+            write.result()
 
-# Discrete
-disc_orth(a, path)
-disc_dia(a, path)
-disc_checker(a, path)
+# -----------------------------------------------------------------------------------
 
-# Continuous
-cont_interp_orth(a, path)
-cont_interp_dia(a, path)
-cont_interp_rad(a, path)
+# Only when run as a script (other modules import this file)
 
-# Alphanumeric
-alphanum("A", a, path)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# pipeline.py
+# SAMPLE PIPELINE
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Shared simulation core (cached noise model and backend)
+from simulation import warm_up
+
+# Stage timers for --profile
+from profiling import profile_enable, profile_call, profile_merge, profile_report
+
+# Sample canvases and processing of experiment3
+from generate_sample_img import sample_imgs, save_imgs
+from experiment3 import qc_processing, stream_qc_processing
+
+# Handy math libraries
+import numpy as np
+
+# Command line arguments parsing
+import argparse
+
+# Process pool for whole sample suites
+from concurrent.futures import ProcessPoolExecutor
+
+# For saving files in current directory
+import os
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# Process one sample canvas as experiment3 would process its file
+#
+# The greyscale canvas serves every color channel, as the grey sample file does,
+# and goes through the same bands of 8 rows and seeds as a single experiment3 run,
+# so the output equals that of experiment3.py on the written sample file.
+
+def render_sample(canvas, name, resolution, channel, process, seed, path, label, dedup=False):
+    a = len(canvas)
+
+    out = f"{path}/{name[:-4]}_{label}_{a * resolution}x{a * resolution}px.png"
+    stream_qc_processing(np.reshape(canvas, (a, a, 1)), resolution, channel, process, 8, out, seed, dedup=dedup)
+
+    return out
+
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
+
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to generate the
+                        sample images in memory and process them
+                        with experiment3 right away, without
+                        writing and reading them as files.
+                        ''',
+        epilog      =   '''
+                        Your created noise images will
+                        be filed in the directory of
+                        experiment3.
+                        ''')
+
+    parser.add_argument('--sidelength',
+        type        =   int,
+        nargs       =   '+',
+        required    =   True,
+        help        =   '''
+                        One or more side lengths of the sample
+                        images, e.g. 8 16 32.
+                        ''')
+
+    parser.add_argument('--resolution',
+        type        =   int,
+        required    =   False,
+        default     =   2,
+        help        =   '''
+                        This determines the desity of the noise
+                        pattern of each computed pixel.
+                        ''')
+
+    parser.add_argument('--channel',
+        type        =   str,
+        required    =   False,
+        choices     =   ['r', 'g', 'b', 'rgb'],
+        help        =   '''
+                        Color channel as in experiment3. The sample
+                        images are grey, so 'rgb' only changes the
+                        output into a color noise image.
+                        ''')
+
+    parser.add_argument('--method',
+        type        =   str,
+        required    =   True,
+        choices     =   ['serial', 'parallel'],
+        help        =   '''
+                        Method of computation as in experiment3.
+                        ''')
+
+    parser.add_argument('--batch',
+        type        =   int,
+        required    =   False,
+        default     =   1024,
+        help        =   '''
+                        Number of pixel circuits per simulator
+                        call of the 'serial' method.
+                        ''')
+
+    parser.add_argument('--dedup',
+        action      =   'store_true',
+        help        =   '''
+                        Simulate every intensity level only once
+                        with the 'serial' method.
+                        ''')
+
+    parser.add_argument('--memory',
+        type        =   float,
+        required    =   False,
+        default     =   256,
+        help        =   '''
+                        Memory budget in MB per simulator call of
+                        the 'parallel' method.
+                        ''')
+
+    parser.add_argument('--engine',
+        type        =   str,
+        required    =   False,
+        default     =   'aer',
+        choices     =   ['aer', 'analytic'],
+        help        =   '''
+                        Simulate circuits with 'aer' (default) or
+                        draw the shots from their exact outcome
+                        probabilities with 'analytic'.
+                        ''')
+
+    parser.add_argument('--seed',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Seed for the simulation. Runs with the same
+                        seed and settings give identical output.
+                        ''')
+
+    parser.add_argument('--workers',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Number of processes working on different
+                        sample images at the same time.
+                        ''')
+
+    parser.add_argument('--samples',
+        action      =   'store_true',
+        help        =   '''
+                        Also write the sample images into the
+                        directory of generate_sample_img.
+                        ''')
+
+    parser.add_argument('--profile',
+        type        =   str,
+        nargs       =   '?',
+        const       =   '',
+        required    =   False,
+        help        =   '''
+                        Report time and calls of every stage on
+                        stderr. Optionally also written to a JSON
+                        file.
+                        ''')
+
+    args = parser.parse_args()
+
+    # Argument 'seed' (non-negative integers only)
+    if args.seed is not None and args.seed < 0:
+        parser.error('argument --seed: must not be negative')
+
+    # Argument 'profile'
+    if args.profile is not None:
+        profile_enable()
+
+    # Create directory for output images
+    path = os.path.join(os.getcwd(), 'experiment3_output')
+    os.makedirs(path, exist_ok=True)
+
+    # Mapping arguments as in experiment3
+    channel = {None: 0, 'r': 0, 'g': 1, 'b': 2, 'rgb': (0, 1, 2)}[args.channel]
+    label = args.method if args.engine == 'aer' else args.engine
+    process = qc_processing(args.engine, args.method, channel, args.batch, args.memory)
+    dedup = args.dedup and args.engine == 'aer' and args.method == 'serial'
+
+    # -----------------------------------------------------------------------------------
+
+    for a in args.sidelength:
+        imgs = list(sample_imgs(a))
+
+        # Argument 'samples'
+        if args.samples:
+            sample_path = os.path.join(os.getcwd(), 'sample_img', f"{a}x{a}")
+            os.makedirs(sample_path, exist_ok=True)
+            save_imgs(imgs, sample_path)
+
+        # Single process
+        if not args.workers:
+            for canvas, name in imgs:
+                print(render_sample(canvas, name, args.resolution, channel, process, args.seed, path, label, dedup))
+            continue
+
+        # Process pool, every worker keeps its own warm simulator (Aer only)
+        with ProcessPoolExecutor(args.workers, initializer=warm_up if args.engine == 'aer' else None) as pool:
+            futures = []
+            for canvas, name in imgs:
+                task = (render_sample, canvas, name, args.resolution, channel, process, args.seed, path, label, dedup)
+                futures.append(pool.submit(profile_call, *task) if args.profile is not None else pool.submit(*task))
+
+            for future in futures:
+                out = future.result()
+                if args.profile is not None:
+                    out, stats = out
+                    profile_merge(stats)
+                print(out)
+
+    # Argument 'profile'
+    profile_report(args.profile)
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script (worker processes and other modules import this file)
+
+if __name__ == '__main__':
+    main()
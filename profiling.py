@@ -0,0 +1,136 @@
+# profiling.py
+# SHARED STAGE PROFILING
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Timers and report output
+import time
+import sys
+import json
+
+# Context manager for timed stages
+from contextlib import contextmanager
+
+# Peak memory (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL CONSTANTS
+# -----------------------------------------------------------------------------------
+
+# Profile of this process: start time, seconds and calls per stage, event counts
+PROFILE = {'enabled': False, 'start': 0.0, 'stages': {}, 'counts': {}}
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# Start profiling this process (stages and counts are free while disabled)
+
+def profile_enable():
+    PROFILE['enabled'] = True
+    PROFILE['start'] = time.perf_counter()
+
+# -----------------------------------------------------------------------------------
+
+# Time a stage, adding up seconds and calls of every stage name
+
+@contextmanager
+def stage(name):
+    if not PROFILE['enabled']:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = PROFILE['stages'].setdefault(name, [0.0, 0])
+        entry[0] += time.perf_counter() - start
+        entry[1] += 1
+
+# -----------------------------------------------------------------------------------
+
+# Count an event, e.g. one simulator call
+
+def count(name, n=1):
+    if PROFILE['enabled']:
+        PROFILE['counts'][name] = PROFILE['counts'].get(name, 0) + n
+
+# -----------------------------------------------------------------------------------
+
+# Run a function in a worker process with profiling, returning its output and the
+# stages and counts it added (merged into the main process by profile_merge)
+
+def profile_call(function, *args, **kwargs):
+    PROFILE['enabled'] = True
+    PROFILE['stages'] = {}
+    PROFILE['counts'] = {}
+
+    out = function(*args, **kwargs)
+
+    return out, (PROFILE['stages'], PROFILE['counts'])
+
+# -----------------------------------------------------------------------------------
+
+# Add the stages and counts of a worker to this process
+
+def profile_merge(stats):
+    stages, counts = stats
+    for name, (seconds, calls) in stages.items():
+        entry = PROFILE['stages'].setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+    for name, n in counts.items():
+        count(name, n)
+
+# -----------------------------------------------------------------------------------
+
+# Peak resident memory in MB of this process or of its finished child processes
+
+def peak_rss_mb(who='self'):
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+
+    # Reported in bytes on macOS, in kB elsewhere
+    return usage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+# -----------------------------------------------------------------------------------
+
+# Print the profile to stderr and optionally write it to a JSON file
+#
+# Stage seconds of workers add up over all processes and may exceed the wall time.
+
+def profile_report(path=None):
+    if not PROFILE['enabled']:
+        return
+
+    report = {
+        'wall_s': round(time.perf_counter() - PROFILE['start'], 4),
+        'stages': {name: {'seconds': round(seconds, 4), 'calls': calls} for name, (seconds, calls) in PROFILE['stages'].items()},
+        'counts': dict(PROFILE['counts']),
+        'peak_rss_mb': peak_rss_mb('self'),
+        'peak_rss_children_mb': peak_rss_mb('children'),
+    }
+
+    print(f"{'stage':<16}{'seconds':>10}{'calls':>10}", file=sys.stderr)
+    for name, entry in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name:<16}{entry['seconds']:>10.3f}{entry['calls']:>10}", file=sys.stderr)
+    for name, n in report['counts'].items():
+        print(f"{name + ' calls':<26}{n:>10}", file=sys.stderr)
+    print(f"{'wall':<16}{report['wall_s']:>10.3f}", file=sys.stderr)
+    if report['peak_rss_mb'] is not None:
+        print(f"{'peak RSS (MB)':<16}{report['peak_rss_mb']:>10.1f}", file=sys.stderr)
+        if report['peak_rss_children_mb']:
+            print(f"{'children (MB)':<16}{report['peak_rss_children_mb']:>10.1f}", file=sys.stderr)
+
+    if path:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
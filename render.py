@@ -0,0 +1,149 @@
+# render.py
+# SHARED RENDER JOBS
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Shared simulation core (cached noise model and backend)
+from simulation import run_qc_sweep, phase_circuit, sample_qc, derive_seed, seed_block
+
+# PILlow for image encoding
+from PIL import Image
+
+# Shared image assembling
+from canvas import tiles_to_array
+
+# Stage timers for --profile
+from profiling import stage
+
+# Phase mapping and image decoding of experiment3
+from experiment3 import lin_map, img_array, img_channels
+
+# Handy math libraries
+import numpy as np
+
+# Caching of sweep circuits
+from functools import lru_cache
+
+# Image bytes in memory
+import io
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL CONSTANTS
+# -----------------------------------------------------------------------------------
+
+# Channel names of experiment3
+CHANNELS = {'r': (0,), 'g': (1,), 'b': (2,), 'rgb': (0, 1, 2)}
+
+# Largest number of pixel circuits in one simulator call
+MAX_PHASES = 4096
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# Phase circuit with a free parameter, built once per reset option
+
+@lru_cache(maxsize=None)
+def sweep_circuit(reset):
+    from qiskit.circuit import Parameter
+
+    phase = Parameter('phase')
+
+    return phase_circuit(phase, reset), phase
+
+# -----------------------------------------------------------------------------------
+
+# Shots (phases, n_shots) of many phase circuits as Aer parameter sweeps of up to
+# max_phases circuits, every sweep seeded by its first index (seeded sweeps in
+# units of seed_block circuits, so the output does not depend on max_phases)
+
+def sweep_shots(phases, backend, reset, n_shots, seed=None, max_phases=MAX_PHASES):
+    qc, phase = sweep_circuit(reset)
+    if seed is not None:
+        max_phases = seed_block(n_shots)
+
+    results = []
+    for i in range(0, len(phases), max_phases):
+        results += run_qc_sweep(qc, phase, phases[i:i + max_phases], backend, 'bits', n_shots, derive_seed(seed, i))
+
+    return np.reshape(results, (len(phases), n_shots))
+
+# -----------------------------------------------------------------------------------
+
+# Shots of a job, sampled by the analytic engine, batched with other jobs by a
+# renderer (see server.py) or simulated on their own
+
+def render_shots(engine, phases, backend, reset, n_shots, seed=None, renderer=None):
+    if engine == 'analytic':
+        return sample_qc(phases, backend, n_shots, reset, seed)
+
+    if renderer:
+        return renderer.render(phases, backend, reset, n_shots, seed)
+
+    return sweep_shots(np.asarray(phases, dtype=float), backend, reset, n_shots, seed)
+
+# -----------------------------------------------------------------------------------
+
+# Render one job into an 8 bit canvas
+#
+# experiment 1: canvas of sidelength x width from H + measure
+# experiment 2: canvas of sidelength x sidelength for a phase
+# experiment 3: noise image of the input image bytes, resolution x resolution per pixel
+
+def render_canvas(params, body=b'', renderer=None):
+    experiment = str(params.get('experiment', '3'))
+    engine = params.get('engine', 'aer')
+    seed = int(params['seed']) if params.get('seed') is not None else None
+
+    if engine not in ('aer', 'analytic'):
+        raise ValueError(f"unknown engine '{engine}'")
+
+    # Experiment 1 (H + measure is phase_circuit at phase 0 without noise)
+    if experiment == '1':
+        height = int(params['sidelength'])
+        length = int(params.get('width') or height)
+        shots = render_shots(engine, [0], 'sim', False, height * length, seed, renderer)
+        canvas = tiles_to_array([np.reshape(shots, (length, height))])
+
+    # Experiment 2
+    elif experiment == '2':
+        size = int(params['sidelength'])
+        shots = render_shots(engine, [float(params.get('phase', 0))], 'sim', False, size ** 2, seed, renderer)
+        canvas = tiles_to_array([np.reshape(shots, (size, size))])
+
+    # Experiment 3 (every channel value becomes a pixel circuit of its own)
+    elif experiment == '3':
+        resolution = int(params.get('resolution', 2))
+        channels = CHANNELS[params.get('channel', 'r')]
+
+        data = img_array(io.BytesIO(body))
+        h, w = data.shape[:2]
+        values = img_channels(data, channels).reshape(-1)
+
+        shots = render_shots(engine, lin_map(values, 0, 255, 1.5, 0.5), 'sim_noise', True, resolution ** 2, seed, renderer)
+        if len(channels) > 1:
+            canvas = tiles_to_array(np.reshape(shots, (w * h, len(channels), resolution, resolution)), w)
+        else:
+            canvas = tiles_to_array(np.reshape(shots, (w * h, resolution, resolution)), w)
+
+    else:
+        raise ValueError(f"unknown experiment '{experiment}'")
+
+    return canvas
+
+# -----------------------------------------------------------------------------------
+
+# Encode a canvas as PNG, to bytes or to a file
+
+def png_bytes(canvas, path=None):
+    with stage('encoding'):
+        if path:
+            Image.fromarray(canvas).save(path, format='PNG')
+            return path
+
+        out = io.BytesIO()
+        Image.fromarray(canvas).save(out, format='PNG')
+
+    return out.getvalue()
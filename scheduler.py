@@ -0,0 +1,214 @@
+# scheduler.py
+# ASYNC RENDER SCHEDULER
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Shared simulation core (cached noise model and backend)
+from simulation import warm_up
+
+# Shared render jobs
+from render import render_canvas, png_bytes
+
+# Event loop and executor pools
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Command line arguments parsing
+import argparse
+import inspect
+import json
+import sys
+import os
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# One render job: parameters as for render_canvas, the input image (bytes or file
+# path, experiment 3 only) and an optional output path (PNG bytes if none)
+
+class RenderTask:
+
+    def __init__(self, params, image=None, path=None):
+        self.params = params
+        self.image = image
+        self.path = path
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+
+# -----------------------------------------------------------------------------------
+
+# Input image bytes of a task, read in the simulation process. Aer jobs warm the
+# simulator of their worker first (once), analytic ones never load Qiskit.
+
+def task_canvas(params, image):
+    if params.get('engine', 'aer') == 'aer':
+        warm_up()
+
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            image = f.read()
+
+    return render_canvas(params, image or b'')
+
+# -----------------------------------------------------------------------------------
+
+# Call a progress or completion callback, plain function or coroutine
+
+async def notify(callback, *args):
+    if callback is None:
+        return
+
+    out = callback(*args)
+    if inspect.isawaitable(out):
+        await out
+
+# -----------------------------------------------------------------------------------
+
+# Render many tasks with separate limits on concurrent simulation and encoding
+#
+# Simulations run in a process pool (each worker warms its simulator on its first
+# Aer job and keeps it), encodings
+# in a thread pool; the event loop only holds the queued tasks, so thousands of
+# them cost nothing until a slot is free. on_progress(task) is called whenever a
+# task enters a state (simulation, encoding, done or failed), on_done(task) once
+# it has its result or error.
+
+class RenderScheduler:
+
+    def __init__(self, simulations=None, encodings=2, processes=True):
+        self.simulations = simulations or os.cpu_count()
+        self.encodings = encodings
+
+        if processes:
+            self.sim_pool = ProcessPoolExecutor(self.simulations)
+        else:
+            self.sim_pool = ThreadPoolExecutor(self.simulations)
+        self.encode_pool = ThreadPoolExecutor(self.encodings)
+
+        self.sim_slots = asyncio.Semaphore(self.simulations)
+        self.encode_slots = asyncio.Semaphore(self.encodings)
+
+    async def render(self, task, on_progress=None, on_done=None):
+        loop = asyncio.get_running_loop()
+
+        try:
+            async with self.sim_slots:
+                task.state = 'simulation'
+                await notify(on_progress, task)
+                canvas = await loop.run_in_executor(self.sim_pool, task_canvas, task.params, task.image)
+
+            async with self.encode_slots:
+                task.state = 'encoding'
+                await notify(on_progress, task)
+                task.result = await loop.run_in_executor(self.encode_pool, png_bytes, canvas, task.path)
+
+            task.state = 'done'
+
+        except Exception as error:
+            task.state = 'failed'
+            task.error = error
+
+        await notify(on_progress, task)
+        await notify(on_done, task)
+
+        return task
+
+    async def render_all(self, tasks, on_progress=None, on_done=None):
+        return await asyncio.gather(*[self.render(task, on_progress, on_done) for task in tasks])
+
+    def close(self):
+        self.sim_pool.shutdown()
+        self.encode_pool.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+
+# Render all tasks with a fresh scheduler
+
+async def render_all(tasks, simulations=None, encodings=2, on_progress=None, on_done=None, processes=True):
+    async with RenderScheduler(simulations, encodings, processes) as scheduler:
+        return await scheduler.render_all(tasks, on_progress, on_done)
+
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
+
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to render a list
+                        of jobs of all three experiments with a
+                        bounded number of concurrent simulations
+                        and encodings.
+                        ''',
+        epilog      =   '''
+                        Every line of the job file is a JSON object
+                        with the parameters of one job, its 'input'
+                        image (experiment 3) and its 'output' path.
+                        ''')
+
+    parser.add_argument('jobs',
+        type        =   str,
+        help        =   '''
+                        Job file with one JSON object per line,
+                        e.g. {"experiment": 3, "resolution": 4,
+                        "input": "a.png", "output": "b.png"}.
+                        ''')
+
+    parser.add_argument('--simulations',
+        type        =   int,
+        required    =   False,
+        help        =   '''
+                        Number of concurrent simulations, each in its
+                        own process (default: number of CPUs).
+                        ''')
+
+    parser.add_argument('--encodings',
+        type        =   int,
+        required    =   False,
+        default     =   2,
+        help        =   '''
+                        Number of concurrent PNG encodings.
+                        ''')
+
+    args = parser.parse_args()
+
+    # Read jobs
+    tasks = []
+    with open(args.jobs) as f:
+        for line in f:
+            if line.strip():
+                params = json.loads(line)
+                tasks.append(RenderTask(params, params.pop('input', None), params.pop('output')))
+
+    # Progress on stderr
+    finished = []
+    def on_done(task):
+        finished.append(task)
+        status = task.error if task.error else task.path
+        print(f"[{len(finished)}/{len(tasks)}] {status}", file=sys.stderr)
+
+    asyncio.run(render_all(tasks, args.simulations, args.encodings, on_done=on_done))
+
+    if any(task.error for task in tasks):
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script (worker processes and other modules import this file)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# server.py
+# RENDER SERVER
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Shared simulation core (cached noise model and backend)
+from simulation import warm_up
+
+# Shared render jobs
+from render import sweep_circuit, sweep_shots, render_canvas, png_bytes
+
+# Handy math libraries
+import numpy as np
+
+# Command line arguments parsing
+import argparse
+
+# HTTP on TCP or a Unix socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import socketserver
+import socket
+import os
+
+# Job queue of the batching thread
+import threading
+import queue
+import time
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+
+# One render request reduced to phase circuits: shots (phases, n_shots) once done
+
+class RenderJob:
+
+    def __init__(self, phases, backend, reset, n_shots, seed=None):
+        self.phases = np.asarray(phases, dtype=float)
+        self.backend = backend
+        self.reset = reset
+        self.n_shots = n_shots
+        self.seed = seed
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    # Jobs with the same key can share one simulator call
+    def key(self):
+        return (self.backend, self.reset, self.n_shots)
+
+# -----------------------------------------------------------------------------------
+
+# Simulator thread merging concurrent jobs into shared batches
+#
+# Jobs arriving within window seconds of each other are grouped by backend, reset
+# and shots; the phases of a group go to Aer as one parameter sweep, up to
+# max_phases per call. Seeded jobs run on their own so their output stays the same
+# whatever else is queued.
+
+class BatchRenderer:
+
+    def __init__(self, window=0.02, max_phases=4096):
+        self.window = window
+        self.max_phases = max_phases
+        self.jobs = queue.Queue()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def render(self, phases, backend, reset, n_shots, seed=None):
+        job = RenderJob(phases, backend, reset, n_shots, seed)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error:
+            raise job.error
+
+        return job.result
+
+    def run(self):
+        while True:
+            jobs = [self.jobs.get()]
+
+            # Collect what arrives during the window
+            deadline = time.monotonic() + self.window
+            while sum(len(job.phases) for job in jobs) < self.max_phases:
+                try:
+                    jobs.append(self.jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for job in jobs:
+                groups.setdefault(job.key() if job.seed is None else id(job), []).append(job)
+
+            for group in groups.values():
+                self.simulate(group)
+
+    def simulate(self, group):
+        try:
+            phases = np.concatenate([job.phases for job in group])
+
+            # Measurements, max_phases per simulator call
+            results = sweep_shots(phases, group[0].backend, group[0].reset, group[0].n_shots, group[0].seed, self.max_phases)
+
+            # Split results by job
+            start = 0
+            for job in group:
+                job.result = results[start:start + len(job.phases)]
+                start += len(job.phases)
+
+        except Exception as error:
+            for job in group:
+                job.error = error
+
+        for job in group:
+            job.done.set()
+
+# -----------------------------------------------------------------------------------
+
+# HTTP requests: POST /render?experiment=3&resolution=4 with the input image as
+# body returns the output PNG, GET /health answers once the simulator is warm
+
+class RenderHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            return self.reply(404, b'not found\n')
+
+        self.reply(200, b'ok\n')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            return self.reply(404, b'not found\n')
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        try:
+            png = png_bytes(render_canvas(params, body, self.server.renderer))
+        except (KeyError, ValueError, OSError) as error:
+            return self.reply(400, f"{type(error).__name__}: {error}\n".encode())
+        except Exception as error:
+            return self.reply(500, f"{type(error).__name__}: {error}\n".encode())
+
+        self.reply(200, png, 'image/png')
+
+    def reply(self, status, data, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Unix socket clients have no address
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+# -----------------------------------------------------------------------------------
+
+# HTTP server on a Unix socket instead of host and port
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+# -----------------------------------------------------------------------------------
+# CALL FUNCTIONS ACCORDING TO ARGUMENTS
+# -----------------------------------------------------------------------------------
+
+# Command line entry point
+
+def main():
+
+    # Argument parsing from command line
+    parser = argparse.ArgumentParser(
+        description =   '''
+                        Use this piece of software to serve render
+                        jobs of all three experiments from one
+                        long-running process with a warm simulator.
+                        ''',
+        epilog      =   '''
+                        POST /render?experiment=3&resolution=4 with
+                        the input image as request body returns
+                        the noise image as PNG.
+                        ''')
+
+    parser.add_argument('--host',
+        type        =   str,
+        required    =   False,
+        default     =   '127.0.0.1',
+        help        =   '''
+                        Address to listen on.
+                        ''')
+
+    parser.add_argument('--port',
+        type        =   int,
+        required    =   False,
+        default     =   8765,
+        help        =   '''
+                        Port to listen on.
+                        ''')
+
+    parser.add_argument('--socket',
+        type        =   str,
+        required    =   False,
+        help        =   '''
+                        Path of a Unix socket to listen on
+                        instead of host and port.
+                        ''')
+
+    parser.add_argument('--window',
+        type        =   float,
+        required    =   False,
+        default     =   20,
+        help        =   '''
+                        Time in ms to wait for further jobs that
+                        can share a simulator call.
+                        ''')
+
+    parser.add_argument('--max-batch',
+        type        =   int,
+        required    =   False,
+        default     =   4096,
+        help        =   '''
+                        Largest number of pixel circuits in one
+                        simulator call.
+                        ''')
+
+    args = parser.parse_args()
+
+    # Build backend and noise model before the first job
+    warm_up()
+    sweep_circuit(True)
+    sweep_circuit(False)
+
+    # Argument 'socket'
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RenderHandler)
+
+    server.renderer = BatchRenderer(args.window / 1000, args.max_batch)
+    print(f"Serving on {args.socket or f'http://{args.host}:{args.port}'}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# -----------------------------------------------------------------------------------
+
+# Only when run as a script (other modules import this file)
+
+if __name__ == '__main__':
+    main()
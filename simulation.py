@@ -0,0 +1,366 @@
+# simulation.py
+# SHARED SIMULATION CORE
+
+# -----------------------------------------------------------------------------------
+# INCLUDE ALL MODULES
+# -----------------------------------------------------------------------------------
+
+# Handy math libraries
+import numpy as np
+import math
+
+# Caching of noise models and backend
+from functools import lru_cache
+
+# Stage timers for --profile
+from profiling import stage, count
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL CONSTANTS
+# -----------------------------------------------------------------------------------
+
+# Example error probabilities
+P_RESET = 0.03
+P_MEAS = 0.1
+P_GATE1 = 0.05
+
+# Largest number of random draws held in memory by the analytic engine at once
+ANALYTIC_CHUNK = 2 ** 24
+
+# Number of shots per chunk when streaming the shots of one circuit
+SHOT_CHUNK = 2 ** 20
+
+# Largest number of circuits in one seeded unit (see seed_block)
+SEED_BLOCK = 1024
+
+# Largest register of independent qubits in one circuit. Noisy shots are simulated
+# one at a time on the full statevector, so beyond this size a register costs more
+# time per qubit than it saves in per-circuit overhead.
+REGISTER_QUBITS = 10
+
+# -----------------------------------------------------------------------------------
+# DEFINE ALL FUNCTIONS
+# -----------------------------------------------------------------------------------
+#
+# Qiskit is imported by the functions that need it, so importing this module (and
+# running the analytic engine) stays fast and free of Qiskit.
+
+# Import Qiskit (and Aer) once per process, timed as a stage of its own, so that
+# it is not charged to the first circuit construction
+
+@lru_cache(maxsize=None)
+def load_qiskit():
+    with stage('import'):
+        import qiskit
+        import qiskit.providers.aer
+
+# -----------------------------------------------------------------------------------
+
+# Quantum circuit of a single qubit shifted by a phase
+
+def phase_circuit(phase, reset=True):
+    from qiskit import QuantumCircuit
+
+    qc = QuantumCircuit(1)
+    if reset:
+        qc.reset(0)
+    qc.h(0)
+    qc.ry(math.pi * phase, 0)
+    qc.measure_all()
+
+    return qc
+
+# -----------------------------------------------------------------------------------
+
+# Build basic bit-flip error noise model (once per set of error probabilities)
+
+@lru_cache(maxsize=None)
+def bit_flip_noise(p_reset=P_RESET, p_meas=P_MEAS, p_gate1=P_GATE1):
+    from qiskit.providers.aer.noise import NoiseModel, pauli_error
+
+    # QuantumError objects
+    error_reset = pauli_error([('X', p_reset), ('I', 1 - p_reset)])
+    error_meas = pauli_error([('X',p_meas), ('I', 1 - p_meas)])
+    error_gate1 = pauli_error([('X',p_gate1), ('I', 1 - p_gate1)])
+    error_gate2 = error_gate1.tensor(error_gate1)
+
+    # Add errors to noise model
+    noise_bit_flip = NoiseModel()
+    noise_bit_flip.add_all_qubit_quantum_error(error_reset, "reset")
+    noise_bit_flip.add_all_qubit_quantum_error(error_meas, "measure")
+    noise_bit_flip.add_all_qubit_quantum_error(error_gate1, ["u1", "u2", "u3"])
+    noise_bit_flip.add_all_qubit_quantum_error(error_gate2, ["cx"])
+
+    return noise_bit_flip
+
+# -----------------------------------------------------------------------------------
+
+# Load simulator (Aer) once per process
+
+@lru_cache(maxsize=None)
+def aer_backend():
+    from qiskit import Aer
+
+    return Aer.get_backend('aer_simulator')
+
+# -----------------------------------------------------------------------------------
+
+# Build backend and default noise model ahead of the first circuit (e.g. in workers)
+
+def warm_up():
+    aer_backend()
+    bit_flip_noise()
+
+# -----------------------------------------------------------------------------------
+
+# Deterministic sub-seed for one part of a seeded run (unseeded stays None)
+
+def derive_seed(seed, *index):
+    if seed is None:
+        return None
+
+    return int(np.random.SeedSequence([seed, *index]).generate_state(1)[0])
+
+# -----------------------------------------------------------------------------------
+
+# Number of circuits (pixels, frames) of n_shots shots each in one seeded unit
+#
+# A seeded run simulates every unit of this many circuits in a call of its own,
+# with the sub-seed of its index. The unit only depends on the shots, never on
+# batch sizes, bands or processes, so neither does the output. One unit holds no
+# more than a chunk of shots (or a single circuit).
+
+def seed_block(n_shots):
+    return max(min(SEED_BLOCK, SHOT_CHUNK // max(n_shots, 1)), 1)
+
+# -----------------------------------------------------------------------------------
+
+# Execute circuit(s) on Aer with or without noise model
+
+def execute_qc(circuits, backend, n_shots, seed=None, **options):
+    from qiskit import execute
+
+    # Execution and options
+    backend_simulate = aer_backend()
+    if seed is not None:
+        options['seed_simulator'] = seed
+
+    # Noise model (its basis gates, so that parameterized gates get their errors too)
+    if (backend == 'sim_noise'):
+        options['noise_model'] = bit_flip_noise()
+        options['basis_gates'] = bit_flip_noise().basis_gates
+
+    # Transpile and submit to Aer (+ noise model)
+    count('execute')
+    with stage('transpile'):
+        job = execute(circuits,
+                      backend_simulate,
+                      shots = n_shots,
+                      memory = True,
+                      **options)
+
+    # Simulation
+    with stage('simulation'):
+        run = job.result()
+
+    return run
+
+# -----------------------------------------------------------------------------------
+
+# Convert Aer memory (list of bitstrings) in bulk to a uint8 array shaped
+# (shots, qubits), column q holding qubit q
+
+def memory_to_bits(memory):
+    n_qubits = len(memory[0])
+    bits = np.frombuffer(''.join(memory).encode('ascii'), dtype=np.uint8) - ord('0')
+
+    return bits.reshape(len(memory), n_qubits)[:, ::-1]
+
+# -----------------------------------------------------------------------------------
+
+# Simulate Quantum computation
+
+def run_qc(circuit, backend, output, n_shots, seed=None):
+    run = execute_qc(circuit, backend, n_shots, seed)
+
+    with stage('conversion'):
+        if (output == 'count'):
+            out = run.get_counts()
+        if (output == 'memory'):
+            out = run.get_memory()
+        if (output == 'bits'):
+            out = memory_to_bits(run.get_memory())
+
+    return out
+
+# -----------------------------------------------------------------------------------
+
+# Stream the shots of a Quantum circuit in chunks of whole rows of row_shots shots
+# (uint8 arrays shaped (shots, qubits), each chunk simulated by its own call)
+
+def stream_qc(circuit, backend, n_shots, row_shots=1, seed=None):
+    chunk = max(SHOT_CHUNK // row_shots, 1) * row_shots
+
+    for i in range(0, n_shots, chunk):
+        yield run_qc(circuit, backend, 'bits', min(chunk, n_shots - i), derive_seed(seed, i))
+
+# -----------------------------------------------------------------------------------
+
+# Estimated memory (bytes) of one register: statevector and returned shot memory
+
+def register_memory(n_qubits, n_shots):
+    return 16 * 2 ** n_qubits + n_shots * (n_qubits + 49)
+
+# -----------------------------------------------------------------------------------
+
+# Qubits per register and registers per Aer job fitting a memory budget (MB)
+
+def register_layout(n_shots, budget_mb):
+    budget = budget_mb * 2 ** 20
+    max_qubits = min(REGISTER_QUBITS, aer_backend().configuration().n_qubits)
+
+    qb = 1
+    while qb < max_qubits and register_memory(qb + 1, n_shots) <= budget:
+        qb += 1
+    batch_size = max(int(budget // register_memory(qb, n_shots)), 1)
+
+    return qb, batch_size
+
+# -----------------------------------------------------------------------------------
+
+# Simulate many Quantum circuits with one Aer job per batch
+#
+# A seeded call goes to Aer in units of seed_block circuits instead, whatever the
+# batch size: Aer seeds the experiments of a job by their position in the job, so
+# only a fixed split gives the same shots for the same seed.
+
+def run_qc_batch(circuits, backend, output, n_shots, batch_size=0, seed=None):
+
+    # Batch size of 0 (or less) submits all circuits at once
+    if batch_size <= 0:
+        batch_size = max(len(circuits), 1)
+    if seed is not None:
+        batch_size = seed_block(n_shots)
+
+    out = []
+    for i in range(0, len(circuits), batch_size):
+        batch = circuits[i:i + batch_size]
+
+        # Let Aer distribute the experiments of a batch over all cores
+        run = execute_qc(batch, backend, n_shots, derive_seed(seed, i), max_parallel_experiments=0)
+
+        # Split results by experiment index
+        with stage('conversion'):
+            for k in range(len(batch)):
+                if (output == 'count'):
+                    out.append(run.get_counts(k))
+                if (output == 'memory'):
+                    out.append(run.get_memory(k))
+                if (output == 'bits'):
+                    out.append(memory_to_bits(run.get_memory(k)))
+
+    return out
+
+# -----------------------------------------------------------------------------------
+
+# Simulate one parameterized Quantum circuit for many values of its parameter
+#
+# The circuit is transpiled once and Aer binds the values itself, which is much
+# cheaper than one circuit per value. Results come back per value.
+
+def run_qc_sweep(circuit, parameter, values, backend, output, n_shots, seed=None):
+    run = execute_qc(circuit, backend, n_shots, seed, parameter_binds=[{parameter: list(values)}])
+
+    out = []
+    with stage('conversion'):
+        for k in range(len(values)):
+            if (output == 'count'):
+                out.append(run.get_counts(k))
+            if (output == 'memory'):
+                out.append(run.get_memory(k))
+            if (output == 'bits'):
+                out.append(memory_to_bits(run.get_memory(k)))
+
+    return out
+
+# -----------------------------------------------------------------------------------
+
+# Exact probability of measuring '1' for phase_circuit
+#
+# H then RY(pi * phase) on |0> gives P(1) = (1 + sin(pi * phase)) / 2. Each bit flip
+# of the noise model scales sin(pi * phase) by (1 - 2p): a flipped reset starts
+# from |1>, a flip after RY or at the measurement inverts the outcome. A flip
+# after H only changes a global phase.
+
+def p_one(phases, backend, reset=True):
+    s = np.sin(math.pi * np.asarray(phases, dtype=float))
+
+    if (backend == 'sim_noise'):
+        s = s * (1 - 2 * P_GATE1) * (1 - 2 * P_MEAS)
+        if reset:
+            s = s * (1 - 2 * P_RESET)
+
+    return (1 + s) / 2
+
+# -----------------------------------------------------------------------------------
+
+# Draw shots for many phase circuits at once without Aer
+
+def sample_qc(phases, backend, n_shots, reset=True, seed=None):
+    rng = np.random.default_rng(seed)
+
+    p = p_one(phases, backend, reset)
+    out = np.empty((len(p), n_shots), dtype=np.uint8)
+
+    # Bernoulli sampling in chunks of rows to bound temporary memory
+    count('sample')
+    with stage('simulation'):
+        rows = max(ANALYTIC_CHUNK // max(n_shots, 1), 1)
+        for i in range(0, len(p), rows):
+            out[i:i + rows] = rng.random((len(p[i:i + rows]), n_shots)) < p[i:i + rows, None]
+
+    return out
+
+# -----------------------------------------------------------------------------------
+
+# Stream shots of one phase circuit without Aer, chunked like stream_qc
+
+def stream_sample(phase, backend, n_shots, row_shots=1, reset=True, seed=None):
+    chunk = max(SHOT_CHUNK // row_shots, 1) * row_shots
+
+    for i in range(0, n_shots, chunk):
+        yield sample_qc([phase], backend, min(chunk, n_shots - i), reset, derive_seed(seed, i)).reshape(-1, 1)
+
+# -----------------------------------------------------------------------------------
+
+# Statistical equivalence of the analytic engine and Aer
+#
+# Runs phase_circuit on Aer for every phase and compares the frequency of '1'
+# with p_one. Returns the largest absolute z-score over all phases.
+
+def compare_engines(phases, backend, n_shots, reset=True):
+    circuits = [phase_circuit(phase, reset) for phase in phases]
+    counts = run_qc_batch(circuits, backend, 'count', n_shots, 0)
+    p = p_one(phases, backend, reset)
+
+    z_max = 0
+    for i in range(len(phases)):
+        freq = counts[i].get('1', 0) / n_shots
+        sigma = math.sqrt(max(p[i] * (1 - p[i]), 1e-12) / n_shots)
+        z_max = max(z_max, abs(freq - p[i]) / sigma)
+
+    return z_max
+
+# -----------------------------------------------------------------------------------
+# CHECK ENGINES WHEN RUN DIRECTLY
+# -----------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    phases = np.linspace(0, 2.0, num=17, endpoint=True)
+    for backend in ['sim', 'sim_noise']:
+        z_max = compare_engines(phases, backend, 20000)
+
+        # 5 sigma leaves room for 34 comparisons without false alarms
+        print(f"{backend}: max |z| = {z_max:.2f}", 'ok' if z_max < 5 else 'MISMATCH')
+        if z_max >= 5:
+            exit(1)